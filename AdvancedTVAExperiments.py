@@ -31,6 +31,22 @@ def run_exp(**kargs: Dict[str, Any]) -> Tuple[TacticalVotingRisk, List]:
     """
     tva = TacticalVotingRisk(**kargs)
     result = tva.compute_risk()
+    print_risk(tva, result)
+    return tva, result
+
+
+def print_risk(tva: TacticalVotingRisk, result: Dict[str, Tuple]) -> None:
+    """
+    Print some stats of the results of the tva
+
+    Args:
+        tva: TacticalVotingRisk.
+        result: risk results from the tva.
+
+    Returns:
+        None.
+
+    """
     print("--------\nOriginal voting Matrix = \n", tva.situation.voting_matrix)
     for scheme in VotingScheme:
         print("-------------")
@@ -43,7 +59,6 @@ def run_exp(**kargs: Dict[str, Any]) -> Tuple[TacticalVotingRisk, List]:
         print("Total risk: ", total_risk)
         print("Average risk: ", result[scheme.name][2])
         print("Average bool risk: ", result[scheme.name][3])
-    return tva, result
 
 
 def exp_bullet_voting(voters: Optional[int] = 10, options: Optional[int] = 4):
@@ -63,14 +78,6 @@ def exp_bullet_voting(voters: Optional[int] = 10, options: Optional[int] = 4):
     Notes:
         This function plots multiple graphs
     """
-    kargs = {
-        "voters": voters,
-        "candidates": options,
-        "allow_bullet_voting": True,
-    }
-
-    tva, result = run_exp(**kargs)
-
     def job(tva, result, title):
         hist_plot_total_tactical_votes_available_per_voter(voters, result)
         bar_plot_total_tactical_votes_available_per_voter(voters, result)
@@ -115,24 +122,17 @@ def exp_bullet_voting(voters: Optional[int] = 10, options: Optional[int] = 4):
             ax.legend()
             fig.show()
 
-    kargs = {
-        "voters": voters,
-        "candidates": options,
-        "allow_bullet_voting": True,
-    }
+    # Both variants in the same search
+    tva = TacticalVotingRisk(voters, options, allow_bullet_voting="both")
+    results = tva.compute_risk()
 
     print("-- With bullet voting --")
-    tva, result = run_exp(**kargs)
-    job(tva, result, "Change of happiness with bullet voting")
-
-    kargs = {
-        "situation": tva.situation,
-        "allow_bullet_voting": False,
-    }
+    print_risk(tva, results["bullet"])
+    job(tva, results["bullet"], "Change of happiness with bullet voting")
 
     print("\n\n-- Without bullet voting --")
-    tva, result = run_exp(**kargs)
-    job(tva, result, "Change of happiness without bullet voting")
+    print_risk(tva, results["no_bullet"])
+    job(tva, results["no_bullet"], "Change of happiness without bullet voting")
 
 
 def exp_coation(
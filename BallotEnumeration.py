@@ -0,0 +1,268 @@
+"""
+This module enumerates the alternative votings of voters and coalitions.
+
+It contains:
+    * rank_permutations: function that compute the lexicographic rank of permutations
+    * unrank_permutations: function that build permutations from their rank
+    * get_permutation_table: function that return all the permutations of m elements
+    * get_bullet_votings: function that return the bullet votings of m candidates
+    * build_votings: function that build the votings of members from their index
+    * BallotEnumerator: class that generate the votings of a voter or coalition
+"""
+from itertools import chain, permutations
+import math
+from typing import Dict, Iterator, Optional, Tuple
+import numpy as np
+
+# Largest number of candidates whose permutations are kept in a table
+# (10! x 10 int8 is 36 MB, built without larger temporaries), above it the
+# permutations are built from the rank
+MAX_TABLE_CANDIDATES = 10
+
+# key: number of candidates, values: table of the permutations
+_permutation_tables: Dict[int, np.array] = {}
+# key: number of candidates, values: bullet votings
+_bullet_votings: Dict[int, np.array] = {}
+
+
+def rank_permutations(perms: np.array) -> np.array:
+    """
+    Compute the rank of permutations in lexicographic order (Lehmer code),
+    the same order as itertools.permutations(range(m)).
+
+    Args:
+        perms: array of permutations of range(m) with shape (..., m)
+
+    Returns:
+        Array with the rank of each permutation
+    """
+    perms = np.asarray(perms)
+    candidate_am = perms.shape[-1]
+    ranks = np.zeros(perms.shape[:-1], dtype=np.int64)
+    for i in range(candidate_am):
+        # digit of the Lehmer code: smaller elements that come later
+        digit = np.sum(perms[..., i + 1 :] < perms[..., i : i + 1], axis=-1)
+        ranks += digit * math.factorial(candidate_am - 1 - i)
+    return ranks
+
+
+def unrank_permutations(candidate_am: int, ranks: np.array) -> np.array:
+    """
+    Build the permutations of range(candidate_am) with the given ranks in
+    lexicographic order (Lehmer code).
+
+    Args:
+        candidate_am: number of elements of the permutations
+        ranks: array of ranks, between 0 and candidate_am! - 1
+
+    Returns:
+        Array of permutations with shape ranks.shape + (candidate_am,)
+    """
+    ranks = np.asarray(ranks, dtype=np.int64)
+    # smallest signed type of the elements, as the ballots
+    perms = np.empty(
+        ranks.shape + (candidate_am,), dtype=np.min_scalar_type(-candidate_am)
+    )
+    available = np.ones(ranks.shape + (candidate_am,), dtype=bool)
+    for i in range(candidate_am):
+        digit = (ranks // math.factorial(candidate_am - 1 - i)) % (candidate_am - i)
+        # the element is the digit-th of the ones not used yet
+        order = np.cumsum(available, axis=-1) - 1
+        chosen = np.argmax(available & (order == digit[..., None]), axis=-1)
+        perms[..., i] = chosen
+        np.put_along_axis(available, chosen[..., None], False, axis=-1)
+    return perms
+
+
+def get_permutation_table(candidate_am: int) -> np.array:
+    """
+    Table of all the permutations of range(candidate_am), built once for
+    each number of candidates and shared by every voter: the votings of a
+    voter are its honest ballot indexed by the rows of the table.
+
+    Args:
+        candidate_am: number of candidates, at most MAX_TABLE_CANDIDATES
+
+    Returns:
+        Read-only int8 array with shape candidate_am! x candidate_am, in
+        lexicographic order (the first row is the identity)
+    """
+    if candidate_am not in _permutation_tables:
+        # filled directly as int8, in the order of itertools.permutations
+        table = np.fromiter(
+            chain.from_iterable(permutations(range(candidate_am))),
+            dtype=np.int8,
+            count=math.factorial(candidate_am) * candidate_am,
+        ).reshape(-1, candidate_am)
+        table.flags.writeable = False
+        _permutation_tables[candidate_am] = table
+    return _permutation_tables[candidate_am]
+
+
+def get_bullet_votings(candidate_am: int) -> np.array:
+    """
+    Args:
+        candidate_am: number of candidates
+
+    Returns:
+        Read-only int8 array with one bullet voting for each candidate i:
+        (i, -1, -1, ...)
+    """
+    if candidate_am not in _bullet_votings:
+        bullets = np.full((candidate_am, candidate_am), -1, dtype=np.int8)
+        bullets[:, 0] = np.arange(candidate_am)
+        bullets.flags.writeable = False
+        _bullet_votings[candidate_am] = bullets
+    return _bullet_votings[candidate_am]
+
+
+def _get_permutations(candidate_am: int, ranks: np.array) -> np.array:
+    """
+    Args:
+        candidate_am: number of candidates
+        ranks: ranks of the permutations
+
+    Returns:
+        The permutations, from the permutation table for few candidates
+    """
+    if candidate_am <= MAX_TABLE_CANDIDATES:
+        return get_permutation_table(candidate_am)[ranks]
+    # each distinct permutation is built once
+    ranks, inverse = np.unique(ranks, return_inverse=True)
+    return unrank_permutations(candidate_am, ranks)[inverse]
+
+
+def build_votings(honest_ballots: np.array, members: np.array) -> np.array:
+    """
+    Build the votings of some members from their index, as numbered by
+    BallotEnumerator: the permutations of the honest ballot without the
+    honest ballot itself, then the bullet votings.
+
+    Args:
+        honest_ballots: honest preference of each member, shape (..., m)
+        members: index of the voting of each member, shape (...)
+
+    Returns:
+        The votings, with the same shape as honest_ballots
+    """
+    candidate_am = honest_ballots.shape[-1]
+    permutation_votings = math.factorial(candidate_am) - 1
+    ballots = np.empty(honest_ballots.shape, dtype=honest_ballots.dtype)
+
+    permuted = members < permutation_votings
+    # rank 0 is the honest ballot and it is skipped
+    positions = _get_permutations(candidate_am, members[permuted] + 1)
+    ballots[permuted] = np.take_along_axis(
+        honest_ballots[permuted], positions.astype(np.intp), axis=-1
+    )
+
+    bullet = ~permuted
+    ballots[bullet] = get_bullet_votings(candidate_am)[
+        members[bullet] - permutation_votings
+    ]
+    return ballots
+
+
+class BallotEnumerator:
+    """
+    Lazy enumeration of the alternative votings of a voter or coalition.
+
+    The votings of a member are the permutations of its honest ballot, in the
+    order of itertools.permutations and without the honest ballot itself,
+    followed by the bullet votings when they are allowed.
+    The votings of a coalition are the cartesian product of the votings of
+    its members, the first member changing slowest.
+
+    Each voting is identified by its index and the permutations are looked
+    up in the permutation table (built from their rank for many candidates),
+    so any range of votings can be generated without the previous ones:
+    ranges can be split between workers or resumed later.
+    """
+
+    def __init__(
+        self, honest_ballots: np.array, allow_bullet_voting: Optional[bool] = False
+    ) -> None:
+        """
+        Args:
+            honest_ballots: honest preferences of the members, one column
+                for each member (m x k)
+            allow_bullet_voting: whether the bullet votings are included
+        """
+        self.honest_ballots = np.asarray(honest_ballots)
+        self.candidate_am, self.members = self.honest_ballots.shape
+        self._bullet = allow_bullet_voting
+
+        # alternative votings of a member and of the whole coalition
+        self.permutation_votings = math.factorial(self.candidate_am) - 1
+        self.member_votings = self.permutation_votings
+        if self._bullet:
+            self.member_votings += self.candidate_am
+        self.total = self.member_votings**self.members
+
+    def member_indices(self, indices: np.array) -> Tuple[np.array, ...]:
+        """
+        Args:
+            indices: indices of votings of the coalition
+
+        Returns:
+            For each member, the index of its own voting
+        """
+        return np.unravel_index(indices, (self.member_votings,) * self.members)
+
+    def member_ballots(self, member: int) -> np.array:
+        """
+        Args:
+            member: position of the member in the coalition
+
+        Returns:
+            All the votings of the member, in order (member_votings x m)
+        """
+        honest = np.broadcast_to(
+            self.honest_ballots[:, member], (self.member_votings, self.candidate_am)
+        )
+        return build_votings(honest, np.arange(self.member_votings))
+
+    def ballots(self, indices: np.array) -> np.array:
+        """
+        Args:
+            indices: indices of votings of the coalition
+
+        Returns:
+            The votings, with shape len(indices) x k x m
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        ballots = np.empty(
+            (len(indices), self.members, self.candidate_am),
+            dtype=self.honest_ballots.dtype,
+        )
+        for j, member in enumerate(self.member_indices(indices)):
+            permuted = member < self.permutation_votings
+            # rank 0 is the honest ballot and it is skipped
+            positions = _get_permutations(self.candidate_am, member[permuted] + 1)
+            ballots[permuted, j] = self.honest_ballots[:, j][positions]
+
+            bullet = ~permuted
+            ballots[bullet, j] = get_bullet_votings(self.candidate_am)[
+                member[bullet] - self.permutation_votings
+            ]
+        return ballots
+
+    def blocks(
+        self, block_size: int, start: Optional[int] = 0, stop: Optional[int] = None
+    ) -> Iterator[Tuple[np.array, np.array]]:
+        """
+        Generate a range of votings in blocks
+
+        Args:
+            block_size: maximum number of votings in a block
+            start: index of the first voting
+            stop: index after the last voting, by default all the votings
+
+        Yields:
+            The indices of the votings of the block and the votings
+        """
+        if stop is None:
+            stop = self.total
+        for block_start in range(start, stop, block_size):
+            indices = np.arange(block_start, min(block_start + block_size, stop))
+            yield indices, self.ballots(indices)
@@ -0,0 +1,268 @@
+"""
+This module generates voting situations from statistical cultures, the
+distributions of the preferences of the voters.
+
+It contains:
+    * impartial_culture: function that draw each preference uniformly
+    * impartial_anonymous_culture: function that draw each histogram uniformly
+    * polya_urn: function that draw correlated preferences from an urn
+    * mallows: function that draw preferences around a reference ranking
+    * single_peaked: function that draw preferences single peaked on an axis
+"""
+import math
+import time
+from typing import Optional, Sequence, Union
+import numpy as np
+
+from VotingSituation import VotingSituation, ballot_dtype
+from BallotEnumeration import rank_permutations, unrank_permutations
+
+# seed of the generators: an int, a Generator or None for fresh entropy
+Seed = Union[None, int, np.random.Generator]
+
+
+def impartial_culture(
+    voter_am: int, candidate_am: int, seed: Seed = None, histogram: bool = False
+) -> VotingSituation:
+    """
+    Every voter draws its preference uniformly and independently, as the
+    constructor of VotingSituation.
+
+    Args:
+        voter_am: number of voters
+        candidate_am: number of candidates
+        seed: seed or Generator
+        histogram: whether the situation is stored as a histogram
+
+    Returns:
+        situation: the voting situation
+    """
+    situation = VotingSituation.random(voter_am, candidate_am, seed)
+    return _build_situation(situation.voting_matrix.T, histogram)
+
+
+def impartial_anonymous_culture(
+    voter_am: int, candidate_am: int, seed: Seed = None, histogram: bool = False
+) -> VotingSituation:
+    """
+    Every histogram (number of voters of each preference) has the same
+    probability. It is the Pólya urn that adds one copy of the drawn
+    preference, so the m! preferences are never enumerated.
+
+    Args:
+        voter_am: number of voters
+        candidate_am: number of candidates
+        seed: seed or Generator
+        histogram: whether the situation is stored as a histogram
+
+    Returns:
+        situation: the voting situation
+    """
+    return polya_urn(
+        voter_am, candidate_am, 1 / math.factorial(candidate_am), seed, histogram
+    )
+
+
+def polya_urn(
+    voter_am: int,
+    candidate_am: int,
+    alpha: float,
+    seed: Seed = None,
+    histogram: bool = False,
+) -> VotingSituation:
+    """
+    Pólya-Eggenberger urn: the urn starts with one copy of each of the m!
+    preferences, each voter draws a preference and puts it back with
+    alpha * m! more copies. alpha = 0 is the impartial culture, larger
+    values give more voters with the same preference.
+
+    Voter t draws one of the initial copies with probability
+    1 / (1 + alpha * t), a uniform preference, otherwise one of the copies
+    added by a uniform earlier voter. The choices are drawn for all the
+    voters at once, then the copies are followed back to the voter that
+    drew a new preference.
+
+    Args:
+        voter_am: number of voters
+        candidate_am: number of candidates
+        alpha: copies added for each drawn preference, over m!
+        seed: seed or Generator
+        histogram: whether the situation is stored as a histogram
+
+    Returns:
+        situation: the voting situation
+    """
+    if alpha < 0:
+        raise ValueError("alpha must not be negative")
+    rng = np.random.default_rng(seed)
+
+    voters = np.arange(voter_am)
+    new = rng.random(voter_am) * (1 + alpha * voters) < 1
+    earlier = rng.integers(0, np.maximum(voters, 1))
+    source = np.where(new, voters, earlier)
+    # pointer jumping: the earlier voter may itself have copied
+    while True:
+        jumped = source[source]
+        if np.array_equal(jumped, source):
+            break
+        source = jumped
+
+    new_preferences = VotingSituation.random(
+        int(np.sum(new)), candidate_am, rng
+    ).voting_matrix.T
+    preferences = new_preferences[(np.cumsum(new) - 1)[source]]
+    return _build_situation(preferences, histogram)
+
+
+def mallows(
+    voter_am: int,
+    candidate_am: int,
+    phi: float,
+    reference: Optional[Sequence[int]] = None,
+    seed: Seed = None,
+    histogram: bool = False,
+) -> VotingSituation:
+    """
+    Mallows model: the probability of a preference is proportional to
+    phi ** d, d the Kendall tau distance (number of swapped pairs) from the
+    reference ranking. phi = 1 is the impartial culture, phi = 0 gives the
+    reference to every voter.
+
+    The preferences are drawn with the repeated insertion model: the
+    candidates of the reference are inserted one at a time, the i-th one in
+    position j (of i + 1) with probability proportional to phi ** (i - j),
+    the number of candidates it goes before. Each insertion is done for all
+    the voters at once.
+
+    Args:
+        voter_am: number of voters
+        candidate_am: number of candidates
+        phi: dispersion, between 0 and 1
+        reference: reference ranking, range(candidate_am) by default
+        seed: seed or Generator
+        histogram: whether the situation is stored as a histogram
+
+    Returns:
+        situation: the voting situation
+    """
+    if not 0 <= phi <= 1:
+        raise ValueError("phi must be between 0 and 1")
+    rng = np.random.default_rng(seed)
+    dtype = ballot_dtype(candidate_am)
+    if reference is None:
+        reference = np.arange(candidate_am)
+    reference = np.asarray(reference, dtype=dtype)
+
+    # position of each candidate of the reference among the inserted ones
+    positions = np.zeros((voter_am, candidate_am), dtype=dtype)
+    for i in range(1, candidate_am):
+        cumulative = np.cumsum(phi ** np.arange(i, -1, -1.0))
+        insert = np.searchsorted(
+            cumulative / cumulative[-1], rng.random(voter_am), side="right"
+        ).astype(dtype)
+        inserted = positions[:, :i]
+        inserted += inserted >= insert[:, None]
+        positions[:, i] = insert
+
+    preferences = np.empty((voter_am, candidate_am), dtype=dtype)
+    np.put_along_axis(
+        preferences, positions, np.broadcast_to(reference, preferences.shape), axis=1
+    )
+    return _build_situation(preferences, histogram)
+
+
+def single_peaked(
+    voter_am: int,
+    candidate_am: int,
+    axis: Optional[Sequence[int]] = None,
+    seed: Seed = None,
+    histogram: bool = False,
+) -> VotingSituation:
+    """
+    Every preference single peaked on the axis has the same probability
+    (Walsh): the preference is built from the last position, each time
+    taking the leftmost or the rightmost remaining candidate of the axis
+    with probability 1/2. Each of the 2^(m-1) preferences is built once.
+
+    Args:
+        voter_am: number of voters
+        candidate_am: number of candidates
+        axis: order of the candidates on the axis, range(candidate_am) by
+            default
+        seed: seed or Generator
+        histogram: whether the situation is stored as a histogram
+
+    Returns:
+        situation: the voting situation
+    """
+    rng = np.random.default_rng(seed)
+    dtype = ballot_dtype(candidate_am)
+    if axis is None:
+        axis = np.arange(candidate_am)
+    axis = np.asarray(axis, dtype=dtype)
+
+    preferences = np.empty((voter_am, candidate_am), dtype=dtype)
+    left = np.zeros(voter_am, dtype=np.intp)
+    right = np.full(voter_am, candidate_am - 1, dtype=np.intp)
+    for position in range(candidate_am - 1, 0, -1):
+        take_left = rng.integers(0, 2, voter_am, dtype=bool)
+        preferences[:, position] = np.where(take_left, axis[left], axis[right])
+        left += take_left
+        right -= ~take_left
+    preferences[:, 0] = axis[left]
+    return _build_situation(preferences, histogram)
+
+
+def _build_situation(preferences: np.array, histogram: bool) -> VotingSituation:
+    """
+    Args:
+        preferences: preference of each voter, one row each
+        histogram: whether the situation is stored as a histogram
+
+    Returns:
+        situation: the voting situation
+    """
+    matrix = preferences.T
+    if not histogram:
+        return VotingSituation.from_matrix(matrix)
+
+    candidate_am = matrix.shape[0]
+    if math.factorial(candidate_am) > np.iinfo(np.int64).max:
+        # the ranks do not fit in int64
+        return VotingSituation.from_histogram(
+            *np.unique(matrix, axis=1, return_counts=True)
+        )
+    # count the voters of each permutation by its rank, only the observed
+    # permutations are built
+    ranks, counts = np.unique(rank_permutations(preferences), return_counts=True)
+    ballots = unrank_permutations(candidate_am, ranks).T.astype(matrix.dtype)
+    return VotingSituation.from_histogram(ballots, counts)
+
+if __name__ == "__main__":
+    VOTERS = 10**6
+    CANDIDATES = 5
+    CULTURES = {
+        "impartial culture": lambda h: impartial_culture(VOTERS, CANDIDATES, 0, h),
+        "impartial anonymous culture": lambda h: impartial_anonymous_culture(
+            VOTERS, CANDIDATES, 0, h
+        ),
+        "Polya urn (alpha=0.1)": lambda h: polya_urn(VOTERS, CANDIDATES, 0.1, 0, h),
+        "Mallows (phi=0.5)": lambda h: mallows(
+            VOTERS, CANDIDATES, 0.5, seed=0, histogram=h
+        ),
+        "single peaked": lambda h: single_peaked(
+            VOTERS, CANDIDATES, seed=0, histogram=h
+        ),
+    }
+    print(f"Generating {VOTERS} voters with {CANDIDATES} candidates.")
+    for name, generate in CULTURES.items():
+        start = time.time()
+        generate(False)
+        matrix_time = time.time() - start
+        start = time.time()
+        situation = generate(True)
+        histogram_time = time.time() - start
+        print(
+            f"{name}: matrix {matrix_time:.3f}s, histogram {histogram_time:.3f}s,"
+            f" {len(situation.counts)} distinct preferences"
+        )
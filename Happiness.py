@@ -3,9 +3,11 @@ This module defines the happiness functions.
 
 It contains:
     * Happiness: class representing the happiness function
+    * HappinessCache: happiness of the voters under the recent outcomes
 """
+from collections import OrderedDict
+from typing import Dict, Optional, Callable
 import math
-from typing import Optional, Callable
 import numpy as np
 
 
@@ -15,13 +17,30 @@ class Happiness:
     of the voters and the overall happiness
     """
 
-    def __init__(self, voting_matrix: np.array, election_vector: np.array) -> None:
+    # largest number of outcomes whose ranks are kept, see get_outcome_ranks
+    max_cached_ranks = 2**12
+
+    # key: outcome, values: position of each candidate in the outcome,
+    # least recently used first
+    _outcome_ranks: "OrderedDict[tuple, np.array]" = OrderedDict()
+    # key: number of candidates, values: (distance weights, worst distance)
+    _distance_terms: Dict[int, tuple] = {}
+
+    def __init__(
+        self,
+        voting_matrix: np.array,
+        election_vector: np.array,
+        counts: Optional[np.array] = None,
+    ) -> None:
         """
         Args:
             voting_matrix: matrix containing the voting situation
             election_vetctor: outcome of the voting
+            counts: number of voters of each column of the matrix, for the
+                situations stored as a histogram. One voter each by default.
         """
         self.election_vector = election_vector
+        self.counts = counts
         self.happiness = 0
         self.individual_happiness = np.ndarray(voting_matrix.shape[1])
         self.get_happiness(voting_matrix, self.get_voter_happiness)
@@ -68,13 +87,9 @@ class Happiness:
         Returns:
             happiness for this voter
         """
-        ordered_voting_result = np.sort(self.election_vector)[::-1]
-        total_distance = 0
-        for i, candidate_points in enumerate(self.election_vector):
-            position = np.where(ordered_voting_result == candidate_points)
-            total_distance += abs(position[0][0] - voter_p[i]) * (len(voter_p) - i)
-
-        worst_distance = math.factorial(len(voter_p))
+        positions = self.get_outcome_ranks(self.election_vector)
+        weights, worst_distance = self.get_distance_terms(len(voter_p))
+        total_distance = np.abs(positions - voter_p) @ weights
         return (worst_distance - total_distance) / worst_distance
 
     def get_happiness(
@@ -86,6 +101,10 @@ class Happiness:
         Compute the overall happiness given an happiness function.
 
         The value can be retrieved from the :happiness: attribute.
+        The individual happiness is the one of each column, in the overall
+        happiness each column is weighted by its number of voters.
+        The happiness functions of this class are evaluated for all the voters
+        at once, any other function is called voter by voter.
 
         Args:
             voting_matrix: matrix containing the voting situation
@@ -96,6 +115,309 @@ class Happiness:
 
         """
         self.happiness = 0
-        for voter in range(voting_matrix.shape[1]):
-            self.individual_happiness[voter] = happiness_func(voting_matrix[:, voter])
-        self.happiness = np.sum(self.individual_happiness)
+        if self.get_matrix_function(happiness_func) is not None:
+            self.individual_happiness = self.evaluate(
+                voting_matrix.T, self.election_vector[None, :], happiness_func
+            )
+        else:
+            for voter in range(voting_matrix.shape[1]):
+                self.individual_happiness[voter] = happiness_func(
+                    voting_matrix[:, voter]
+                )
+        if self.counts is None:
+            self.happiness = np.sum(self.individual_happiness)
+        else:
+            self.happiness = np.sum(self.individual_happiness * self.counts)
+
+    @classmethod
+    def evaluate(
+        cls,
+        ballots: np.array,
+        election_vectors: np.array,
+        happiness_func: Callable[[np.array], float] = get_voter_happiness,
+    ) -> np.array:
+        """
+        Compute the happiness of many ballots under many outcomes at once.
+
+        Args:
+            ballots: array of preferences with shape (..., m), the last axis
+                is a single ballot
+            election_vectors: array of outcomes with shape (..., m), it must
+                have the same number of dimensions as ballots and broadcast
+                against it
+            happiness_func: one of the happiness functions of this class
+                (bound or not). Other functions are called ballot by ballot.
+
+        Returns:
+            Array with the happiness of each ballot, its shape is the
+            broadcast of the leading dimensions of the two arguments.
+        """
+        ballots = np.asarray(ballots)
+        election_vectors = np.asarray(election_vectors)
+
+        matrix_func = cls.get_matrix_function(happiness_func)
+        if matrix_func is not None:
+            return matrix_func(ballots, election_vectors)
+
+        # Generic function: call it for each ballot
+        shape = np.broadcast_shapes(ballots.shape[:-1], election_vectors.shape[:-1])
+        ballots = np.broadcast_to(ballots, shape + ballots.shape[-1:])
+        election_vectors = np.broadcast_to(
+            election_vectors, shape + election_vectors.shape[-1:]
+        )
+        happiness_func = getattr(happiness_func, "__func__", happiness_func)
+        result = np.ndarray(shape)
+        for idx in np.ndindex(shape):
+            outcome = cls.__new__(cls)
+            outcome.election_vector = election_vectors[idx]
+            result[idx] = happiness_func(outcome, ballots[idx])
+        return result
+
+    @classmethod
+    def get_matrix_function(
+        cls, happiness_func: Callable
+    ) -> Optional[Callable[[np.array, np.array], np.array]]:
+        """
+        Args:
+            happiness_func: happiness function for a single voter
+
+        Returns:
+            The matrix form of the function, None if it has no matrix form.
+        """
+        happiness_func = getattr(happiness_func, "__func__", happiness_func)
+        for name, matrix_name in _MATRIX_FUNCTIONS.items():
+            if happiness_func is Happiness.__dict__[name]:
+                return getattr(cls, matrix_name)
+        return None
+
+    @classmethod
+    def get_outcome_ranks(cls, election_vector: np.array) -> np.array:
+        """
+        Position of each candidate in the ordered outcome: the amount of
+        candidates with more votes (first position in case of ties).
+
+        The positions are computed once for each outcome and kept for the
+        max_cached_ranks outcomes used most recently.
+
+        Args:
+            election_vector: outcome of the voting
+
+        Returns:
+            Read-only array with the position of each candidate
+        """
+        key = tuple(np.asarray(election_vector).tolist())
+        positions = cls._outcome_ranks.get(key)
+        if positions is not None:
+            cls._outcome_ranks.move_to_end(key)
+            return positions
+
+        votes = np.array(key)
+        positions = np.sum(votes[None, :] > votes[:, None], axis=1)
+        positions.flags.writeable = False
+        cls._outcome_ranks[key] = positions
+        if len(cls._outcome_ranks) > cls.max_cached_ranks:
+            cls._outcome_ranks.popitem(last=False)
+        return positions
+
+    @classmethod
+    def get_distance_terms(cls, candidate_am: int) -> tuple:
+        """
+        Args:
+            candidate_am: number of candidates
+
+        Returns:
+            The weight of the distance of each position of the ballot and the
+            worst distance (candidate_am!) used to normalise it
+        """
+        if candidate_am not in cls._distance_terms:
+            cls._distance_terms[candidate_am] = (
+                np.arange(candidate_am, 0, -1),
+                math.factorial(candidate_am),
+            )
+        return cls._distance_terms[candidate_am]
+
+    @staticmethod
+    def get_position_weight(
+        happiness_func: Callable, candidate_am: int
+    ) -> Optional[np.array]:
+        """
+        The default and dictatorship happiness functions are linear in the
+        share of votes of the candidates, each position of the ballot has a
+        fixed weight.
+
+        Args:
+            happiness_func: happiness function for a single voter
+            candidate_am: number of candidates
+
+        Returns:
+            The weight of each position, None if the function is not linear.
+        """
+        happiness_func = getattr(happiness_func, "__func__", happiness_func)
+        if happiness_func is Happiness.__dict__["get_voter_happiness"]:
+            return np.arange(candidate_am, -candidate_am, -2)
+        if happiness_func is Happiness.__dict__["get_voter_happiness_dictatorship"]:
+            return np.array([1] + [0] * (candidate_am - 1))
+        return None
+
+    @staticmethod
+    def positional_happiness(
+        ballots: np.array, election_vectors: np.array, weight: np.array
+    ) -> np.array:
+        """
+        Matrix form of the happiness functions that weight the share of votes
+        of each candidate by its position in the ballot.
+
+        The sum is done position by position, in the same order as the
+        functions for a single voter.
+
+        Args:
+            ballots: array of preferences with shape (..., m)
+            election_vectors: array of outcomes with shape (..., m)
+            weight: weight of each position
+
+        Returns:
+            Array with the happiness of each ballot
+        """
+        candidate_am = election_vectors.shape[-1]
+        total_votes = np.sum(election_vectors, axis=-1, keepdims=True)
+        # same candidate as election_vector[v - 1], -1 (no vote) included
+        shares = (
+            np.take_along_axis(election_vectors, (ballots - 1) % candidate_am, -1)
+            / total_votes
+        )
+        happiness = 0
+        for i in range(ballots.shape[-1]):
+            happiness = happiness + shares[..., i] * weight[i]
+        return happiness
+
+    @classmethod
+    def matrix_voter_happiness(
+        cls, ballots: np.array, election_vectors: np.array
+    ) -> np.array:
+        """
+        Matrix form of get_voter_happiness
+        """
+        weight = cls.get_position_weight(cls.get_voter_happiness, ballots.shape[-1])
+        return cls.positional_happiness(ballots, election_vectors, weight)
+
+    @classmethod
+    def matrix_voter_happiness_dictatorship(
+        cls, ballots: np.array, election_vectors: np.array
+    ) -> np.array:
+        """
+        Matrix form of get_voter_happiness_dictatorship
+        """
+        weight = cls.get_position_weight(
+            cls.get_voter_happiness_dictatorship, ballots.shape[-1]
+        )
+        return cls.positional_happiness(ballots, election_vectors, weight)
+
+    @classmethod
+    def matrix_voter_happiness_vector_distance(
+        cls, ballots: np.array, election_vectors: np.array
+    ) -> np.array:
+        """
+        Matrix form of get_voter_happiness_vector_distance
+
+        The positions of a single outcome come from get_outcome_ranks, the
+        ones of a stack of outcomes are computed for all of them at once.
+        """
+        candidate_am = ballots.shape[-1]
+        if election_vectors.size == candidate_am:
+            positions = cls.get_outcome_ranks(election_vectors.reshape(-1)).reshape(
+                election_vectors.shape
+            )
+        else:
+            # Position of each candidate in the ordered result: the amount of
+            # candidates with more votes (first position in case of ties)
+            positions = np.sum(
+                election_vectors[..., None, :] > election_vectors[..., :, None],
+                axis=-1,
+            )
+        weights, worst_distance = cls.get_distance_terms(candidate_am)
+        total_distance = np.abs(positions - ballots) @ weights
+        return (worst_distance - total_distance) / worst_distance
+
+
+class HappinessCache:
+    """
+    Happiness of every voter of a voting matrix under the outcomes used most
+    recently, for each happiness function.
+
+    Many alternative votings lead to the same outcome, for example under
+    VOTE_FOR_ONE and VETO. The happiness of the voters that keep their
+    ballot only depends on the outcome, so it is computed once for each
+    outcome. The voters that change their ballot must still be evaluated
+    with their new ballot by the caller.
+
+    The cache keeps at most max_size outcomes and drops the least recently
+    used one. hits, misses and evictions count its use.
+    """
+
+    def __init__(self, voting_matrix: np.array, max_size: int = 2**8) -> None:
+        """
+        Args:
+            voting_matrix: matrix containing the voting situation
+            max_size: largest number of outcomes kept
+        """
+        self.voting_matrix = voting_matrix
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key: (outcome, happiness function), values: happiness of each
+        # column, least recently used first
+        self._entries: "OrderedDict[tuple, np.array]" = OrderedDict()
+
+    def get(
+        self,
+        election_vector: np.array,
+        happiness_func: Callable = Happiness.get_voter_happiness,
+    ) -> np.array:
+        """
+        Args:
+            election_vector: outcome of the voting
+            happiness_func: happiness function of the voters
+
+        Returns:
+            Read-only array with the happiness of each column of the voting
+            matrix under the outcome
+        """
+        happiness_func = getattr(happiness_func, "__func__", happiness_func)
+        key = (tuple(np.asarray(election_vector).tolist()), happiness_func)
+        happiness = self._entries.get(key)
+        if happiness is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return happiness
+
+        self.misses += 1
+        happiness = Happiness.evaluate(
+            self.voting_matrix.T, np.asarray(election_vector)[None, :], happiness_func
+        )
+        happiness.flags.writeable = False
+        self._entries[key] = happiness
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return happiness
+
+    def cache_info(self) -> Dict[str, int]:
+        """
+        Returns:
+            The hits, misses, evictions and current size of the cache
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
+
+
+# name of the matrix form of each happiness function
+_MATRIX_FUNCTIONS = {
+    "get_voter_happiness": "matrix_voter_happiness",
+    "get_voter_happiness_dictatorship": "matrix_voter_happiness_dictatorship",
+    "get_voter_happiness_vector_distance": "matrix_voter_happiness_vector_distance",
+}
@@ -0,0 +1,336 @@
+"""
+This module finds the tactical votings of a voter without enumerating all
+the alternative ballots, for elections with many candidates.
+
+It contains:
+    * ManipulationSolver: class that build the best response of a voter
+    * cross_check: function that compare the solver with the exhaustive search
+"""
+from itertools import combinations
+from typing import Callable, Dict, Iterator, Optional, Tuple
+import math
+import numpy as np
+
+from VotingSituation import VotingSituation, IncrementalTally, ballot_votes
+from Vot_Scheme import VotingScheme, compute_scheme_runs
+from Happiness import Happiness
+from BallotEnumeration import BallotEnumerator, get_bullet_votings
+
+
+class ManipulationSolver:
+    """
+    Best response of a voter that changes its ballot, the others keeping the
+    honest ones.
+
+    The votes given by a ballot only depend on which candidates are in each
+    run of positions with the same votes (see compute_scheme_runs): for
+    VOTE_FOR_ONE the first choice, for VOTE_FOR_TWO the top pair, for VETO
+    the last choice. When the happiness is linear in the outcome (see
+    Happiness.get_position_weight) and the classes are few, each class is
+    enumerated and its best ballot is built with the rearrangement
+    inequality: inside each run the candidates are sorted by the votes that
+    the happiness weights in their position. The result is the exact best
+    response, in polynomial time in the number of candidates, whenever it is
+    a tactical voting (the other ballots of the class of the honest ballot
+    are not built).
+
+    Otherwise (BORDA has m! classes, or a non linear happiness) the best
+    response is searched with steepest ascent over the swaps of two
+    positions, from the honest ballot and some random ones. The ballot found
+    may not be the best, so a voter may have tactical votings the solver
+    does not find.
+
+    The happiness of a ballot is computed as in TacticalVotingRisk: with the
+    Happiness function of the new ballot under the new outcome. The
+    exhaustive search of all the alternative ballots is kept to verify the
+    solver for few candidates.
+    """
+
+    # largest number of classes enumerated, above it the local search is used
+    max_classes = 10**5
+    # number of random starting ballots of the local search
+    restarts = 8
+    # number of ballots evaluated at once by the exhaustive search
+    block_size = 2**16
+
+    def __init__(
+        self,
+        situation: VotingSituation,
+        voting_scheme: VotingScheme,
+        allow_bullet_voting: Optional[bool] = False,
+        happiness_func: Optional[Callable] = Happiness.get_voter_happiness,
+        seed: Optional[int] = 0,
+    ) -> None:
+        """
+        Args:
+            situation: voting situation with the honest ballots
+            voting_scheme: scheme used to assign votes
+            allow_bullet_voting: whether the bullet votings are alternatives
+            happiness_func: happiness function of a single voter
+            seed: seed of the random starting ballots of the local search
+        """
+        self.situation = situation
+        self.tally = IncrementalTally(situation, voting_scheme)
+        self.candidate_am = situation.candidate_am
+        self.happiness_func = happiness_func
+        self._bullet = allow_bullet_voting
+        self._rng = np.random.default_rng(seed)
+
+        honest_happiness = Happiness(
+            situation.voting_matrix, self.tally.outcome, situation.counts
+        )
+        honest_happiness.get_happiness(situation.voting_matrix, happiness_func)
+        self.individual_happiness = honest_happiness.individual_happiness
+
+        self._runs = compute_scheme_runs(voting_scheme, self.candidate_am)
+        self._weight = Happiness.get_position_weight(happiness_func, self.candidate_am)
+        classes = math.factorial(self.candidate_am)
+        for start, end in self._runs:
+            classes //= math.factorial(end - start)
+        # whether the best responses are exact
+        self.exact = self._weight is not None and classes <= self.max_classes
+
+    def best_response(self, voter: int) -> Optional[Tuple[np.array, np.array, float]]:
+        """
+        Args:
+            voter: index of the voter (column of the voting matrix)
+
+        Returns:
+            The best alternative ballot found, the outcome with it and the
+            happiness of the voter. None if the only response is the honest
+            ballot (e.g. VOTE_FOR_TWO with 2 candidates).
+        """
+        honest = self.situation.voting_matrix[:, voter]
+        base = self.tally.without(voter)
+        if self.exact:
+            ballots = self._class_responses(honest, base)
+        else:
+            ballots = self._local_search(honest, base)
+        if self._bullet:
+            ballots = np.concatenate((ballots, get_bullet_votings(self.candidate_am)))
+
+        # the honest ballot is not an alternative
+        ballots = ballots[np.any(ballots != honest, axis=1)]
+        if len(ballots) == 0:
+            return None
+        outcomes, happiness = self._evaluate(ballots, base)
+        best = np.argmax(happiness)
+        return ballots[best], outcomes[best], happiness[best]
+
+    def exhaustive_response(self, voter: int) -> Tuple[np.array, np.array, float]:
+        """
+        Best response among all the alternative ballots, for few candidates
+
+        Args:
+            voter: index of the voter (column of the voting matrix)
+
+        Returns:
+            The best alternative ballot, the outcome with it and the
+            happiness of the voter
+        """
+        honest = self.situation.voting_matrix[:, [voter]]
+        base = self.tally.without(voter)
+        enumerator = BallotEnumerator(honest, self._bullet)
+
+        best = None
+        for _, ballots in enumerator.blocks(self.block_size):
+            outcomes, happiness = self._evaluate(ballots[:, 0], base)
+            b = np.argmax(happiness)
+            if best is None or happiness[b] > best[2]:
+                best = (ballots[b, 0], outcomes[b], happiness[b])
+        return best
+
+    def find_tactical_voting(
+        self, voter: int, exhaustive: Optional[bool] = False
+    ) -> Optional[Tuple[np.array, np.array, float]]:
+        """
+        Args:
+            voter: index of the voter (column of the voting matrix)
+            exhaustive: search all the alternative ballots instead of
+                building the best response
+
+        Returns:
+            A ballot that increases the happiness of the voter, the outcome
+            with it and the new happiness. None if no ballot is found.
+        """
+        if exhaustive:
+            response = self.exhaustive_response(voter)
+        else:
+            response = self.best_response(voter)
+        if response is not None and response[2] > self.individual_happiness[voter]:
+            return response
+        return None
+
+    def _evaluate(self, ballots: np.array, base: np.array) -> Tuple[np.array, np.array]:
+        """
+        Args:
+            ballots: ballots of the voter, B x m
+            base: outcome without the votes of the voter
+
+        Returns:
+            The outcome with each ballot and the happiness of the voter
+        """
+        outcomes = base + ballot_votes(
+            self.tally.scheme_vector, ballots, self.candidate_am
+        )
+        return outcomes, Happiness.evaluate(ballots, outcomes, self.happiness_func)
+
+    def _class_responses(self, honest: np.array, base: np.array) -> np.array:
+        """
+        Build the best ballot of each class of ballots with the same votes
+
+        Args:
+            honest: honest ballot of the voter
+            base: outcome without the votes of the voter
+
+        Returns:
+            One ballot for each class
+        """
+        candidate_am = self.candidate_am
+        sizes = [end - start for start, end in self._runs]
+        scheme_vector = self.tally.scheme_vector
+
+        ballots = []
+        for groups in _ordered_partitions(tuple(range(candidate_am)), sizes):
+            outcome = base.copy()
+            for (start, _), group in zip(self._runs, groups):
+                outcome[list(group)] += scheme_vector[start]
+            # The happiness weights of the position of candidate c the votes
+            # of candidate c - 1 (election_vector[v - 1]), the weights do not
+            # increase: the largest votes go first
+            ballot = []
+            for group in groups:
+                ballot += sorted(group, key=lambda c: -outcome[(c - 1) % candidate_am])
+            ballots.append(ballot)
+        return np.array(ballots, dtype=honest.dtype)
+
+    def _local_search(self, honest: np.array, base: np.array) -> np.array:
+        """
+        Steepest ascent over the swaps of two positions
+
+        Args:
+            honest: honest ballot of the voter
+            base: outcome without the votes of the voter
+
+        Returns:
+            The local optimum reached from each starting ballot
+        """
+        swaps = np.array(list(combinations(range(self.candidate_am), 2)))
+        rows = np.arange(len(swaps))
+        starts = [honest] + [
+            self._rng.permutation(honest) for _ in range(self.restarts)
+        ]
+
+        optima = []
+        for ballot in starts:
+            happiness = self._evaluate(ballot[None], base)[1][0]
+            while True:
+                neighbours = np.repeat(ballot[None], len(swaps), axis=0)
+                neighbours[rows, swaps[:, 0]] = ballot[swaps[:, 1]]
+                neighbours[rows, swaps[:, 1]] = ballot[swaps[:, 0]]
+                values = self._evaluate(neighbours, base)[1]
+                best = np.argmax(values)
+                if values[best] <= happiness:
+                    break
+                ballot, happiness = neighbours[best], values[best]
+            optima.append(ballot)
+        return np.array(optima)
+
+
+def _ordered_partitions(
+    items: Tuple[int, ...], sizes: list
+) -> Iterator[Tuple[Tuple[int, ...], ...]]:
+    """
+    Args:
+        items: elements to split
+        sizes: size of each group, they sum to len(items)
+
+    Yields:
+        Every split of the items in groups of the given sizes
+    """
+    if not sizes:
+        yield ()
+        return
+    for group in combinations(items, sizes[0]):
+        rest = tuple(item for item in items if item not in group)
+        for tail in _ordered_partitions(rest, sizes[1:]):
+            yield (group,) + tail
+
+
+def cross_check(
+    voters: Optional[int] = 10,
+    candidates: Optional[int] = 5,
+    trials: Optional[int] = 20,
+    allow_bullet_voting: Optional[bool] = False,
+    seed: Optional[int] = 0,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Compare the solver with the exhaustive search on random situations,
+    with the given number of candidates and with 2 candidates (where the
+    honest ballot can be the only best response of its class)
+
+    Args:
+        voters (int): number of voters.
+        candidates (int): number of candidates, few enough for the
+            exhaustive search.
+        trials (int): number of random situations.
+        allow_bullet_voting (bool): whether the bullet votings are allowed.
+        seed (int): seed of the situations.
+
+    Returns:
+        For each scheme the number of voters checked, of voters with a
+        tactical voting, of voters for which the solver decides differently
+        ("mismatches") and, when the solver is exact, of voters with a
+        tactical voting whose best happiness differs ("suboptimal"). An
+        AssertionError is raised if there is any mismatch or suboptimal
+        response.
+    """
+    np.random.seed(seed)
+    report = {
+        scheme.name: {"voters": 0, "tactical": 0, "mismatches": 0, "suboptimal": 0}
+        for scheme in VotingScheme
+    }
+    situations = [VotingSituation(voters, candidates) for _ in range(trials)]
+    situations += [VotingSituation(voters, 2) for _ in range(trials)]
+    for situation in situations:
+        for scheme in VotingScheme:
+            solver = ManipulationSolver(situation, scheme, allow_bullet_voting)
+            counts = report[scheme.name]
+            for voter in range(voters):
+                expected = solver.exhaustive_response(voter)
+                found = solver.find_tactical_voting(voter)
+                tactical = expected[2] > solver.individual_happiness[voter]
+
+                counts["voters"] += 1
+                counts["tactical"] += int(tactical)
+                if tactical != (found is not None):
+                    counts["mismatches"] += 1
+                if tactical and solver.exact and not np.isclose(found[2], expected[2]):
+                    counts["suboptimal"] += 1
+
+    failed = {
+        name: counts
+        for name, counts in report.items()
+        if counts["mismatches"] or counts["suboptimal"]
+    }
+    if failed:
+        raise AssertionError(f"Solver differs from the exhaustive search: {failed}")
+    return report
+
+
+if __name__ == "__main__":
+    print("Comparing the solver with the exhaustive search.")
+    for scheme_name, counts in cross_check().items():
+        print(scheme_name, counts)
+
+    np.random.seed(42)
+    VOTERS = 50
+    CANDIDATES = 12
+    situation = VotingSituation(VOTERS, CANDIDATES)
+    for scheme in VotingScheme:
+        solver = ManipulationSolver(situation, scheme)
+        tactical = [solver.find_tactical_voting(v) is not None for v in range(VOTERS)]
+        print(
+            f"{scheme.name}: {sum(tactical)}/{VOTERS} voters can vote tactically"
+            f" ({'exact' if solver.exact else 'local search'})"
+        )
@@ -0,0 +1,401 @@
+"""
+This module plans the computation of the risk of tactical voting.
+
+It contains:
+    * RiskPlanner: class that estimate the cost of each engine of the TVA and
+      pick one that fits the budget
+"""
+from statistics import NormalDist
+from typing import Dict, Optional, Tuple
+import math
+import time
+import numpy as np
+
+from TacticalVotingRisk import TacticalVotingRisk
+from Vot_Scheme import VotingScheme
+from Happiness import Happiness
+from VotingSituation import IncrementalTally
+from ManipulationSolver import ManipulationSolver
+from BallotEnumeration import MAX_TABLE_CANDIDATES
+
+
+class RiskPlanner:
+    """
+    Estimate the evaluations, the peak memory and the time of each way of
+    computing the risks of a TacticalVotingRisk, before running it:
+
+        * exact: compute_risk, every tactical voting is kept
+        * pruned: compute_risk in "counts" mode, the exact risks without
+          the tactical votings
+        * solver: compute_risk in "solver" mode, single voters only
+        * sampled: estimate_risk
+
+    The cost of a block of votings is measured on the first block of a
+    coalition, the cost of a sample and the fraction of tactical votings on
+    a small random sample of each scheme. The first engine in the
+    order above that fits the memory and time budgets is chosen; explain()
+    reports the estimates and the choice.
+    """
+
+    engines = ("exact", "pruned", "solver", "sampled")
+
+    # approximate size of the python objects of the results, in bytes
+    _list_bytes = 56
+    _int_bytes = 36
+    _float_bytes = 32
+    _array_bytes = 112
+
+    def __init__(
+        self,
+        tva: TacticalVotingRisk,
+        memory_budget: Optional[int] = None,
+        time_budget: Optional[float] = None,
+        records: Optional[bool] = True,
+        target_width: Optional[float] = 0.02,
+        confidence: Optional[float] = 0.95,
+        pilot_samples: Optional[int] = 2**11,
+        seed: Optional[int] = 0,
+    ) -> None:
+        """
+        Args:
+            tva (TacticalVotingRisk): analysis to plan
+            memory_budget (Optional - int): bytes that the run can use
+            time_budget (Optional - float): seconds that the run can take
+            records (bool): whether the tactical votings are needed, if not
+                the exact engine is skipped
+            target_width (float): width of the confidence intervals of the
+                sampled engine
+            confidence (float): confidence level of the intervals
+            pilot_samples (int): samples drawn to measure the costs
+            seed (int): seed of the samples
+        """
+        self.tva = tva
+        self.memory_budget = memory_budget
+        self.time_budget = time_budget
+        self.records = records
+        self.target_width = target_width
+        self.confidence = confidence
+        self.pilot_samples = pilot_samples
+        self.seed = seed
+
+        self._measure()
+        # key: engine, values: dictionary with the estimates of the engine
+        self.estimates = {engine: self._estimate(engine) for engine in self.engines}
+        self.engine = next((e for e in self.engines if self.estimates[e]["fits"]), None)
+
+    def run(self, verbose: Optional[bool] = True) -> Dict[str, Tuple]:
+        """
+        Run the chosen engine
+
+        Args:
+            verbose (bool): print information about the original happiness
+        Returns:
+            The results of the engine, in the shape of compute_risk
+        """
+        if self.engine is None:
+            raise RuntimeError("No engine fits the budget\n" + self.explain())
+        if verbose:
+            print(self.explain())
+
+        if self.engine == "exact":
+            return self.tva.compute_risk()
+        if self.engine == "pruned":
+            return self.tva.compute_risk("counts")
+        if self.engine == "solver":
+            return self.tva.compute_risk("solver")
+
+        time_budget = None
+        if self.time_budget is not None:
+            # shared by the schemes of every happiness function and variant
+            time_budget = self.time_budget / (len(VotingScheme) * self._analyses)
+        return self.tva.estimate_risk(
+            target_width=self.target_width,
+            time_budget=time_budget,
+            confidence=self.confidence,
+            seed=self.seed,
+            verbose=verbose,
+        )
+
+    def explain(self) -> str:
+        """
+        Returns:
+            Report of the size of the analysis, of the measured costs, of the
+            estimates of each engine and of the chosen one
+        """
+        tva = self.tva
+        lines = [
+            f"Voters: {tva.voters}, candidates: {tva.options}, "
+            f"coalition size: {tva.coalition_size}, "
+            f"bullet voting: {'both' if len(tva.variants) > 1 else tva.variants[0]}",
+            f"Coalitions: {self._coalitions} ({self._groups} distinct), "
+            f"alternative votings of each: {tva.alternative_votings}",
+            f"Measured: {_format_time(self._block_cost)} per block of votings, "
+            f"{_format_time(self._sample_cost)} per sample, "
+            f"{_format_time(self._record_cost)} per tactical voting, "
+            f"{np.mean(list(self._tactical_rates.values())):.1%} of the votings "
+            "are tactical",
+            f"Budget: memory {_format_bytes(self.memory_budget)}, "
+            f"time {_format_time(self.time_budget)}",
+            "",
+            f"{'engine':<8} {'evaluations':>12} {'memory':>10} {'time':>10}  fits",
+        ]
+        for engine in self.engines:
+            estimate = self.estimates[engine]
+            if estimate["evaluations"] is None:
+                lines.append(f"{engine:<8} {'-':>12} {'-':>10} {'-':>10}  no")
+            else:
+                lines.append(
+                    f"{engine:<8} {estimate['evaluations']:>12.3g} "
+                    f"{_format_bytes(estimate['memory']):>10} "
+                    f"{_format_time(estimate['time']):>10}  "
+                    f"{'yes' if estimate['fits'] else 'no'}"
+                )
+            if estimate["note"]:
+                lines.append(f"{'':<8} {estimate['note']}")
+        lines.append("")
+        lines.append(f"Chosen engine: {self.engine}")
+        return "\n".join(lines)
+
+    def _measure(self) -> None:
+        """
+        Measure the costs on a random sample of each scheme
+        """
+        tva = self.tva
+        rng = np.random.default_rng(self.seed)
+
+        k = tva.coalition_size
+        self._coalitions = math.comb(tva.voters, k)
+        types = tva.preference_types
+        self._types = types
+        self._groups = min(self._coalitions, math.comb(types + k - 1, k))
+        # results of each scheme: one for each happiness function and bullet
+        # voting variant, the exact engines share the search between them
+        self._analyses = len(tva.happiness_functions) * len(tva.variants)
+        # the pilot measures the first of them
+        func = tva.happiness_functions[0]
+        bullet = tva.variants[0]
+
+        # key: scheme, values: fraction of the votings that are tactical
+        self._tactical_rates = {}
+        # key: scheme, values: seconds to solve a voter
+        self._solve_costs = {}
+        sampling = 0
+        enumeration = 0
+        for scheme in VotingScheme:
+            sample = tva.get_tactical_sampler(scheme, func, bullet)
+            start = time.perf_counter()
+            tactical = sample(rng, self.pilot_samples)
+            sampling += time.perf_counter() - start
+            self._tactical_rates[scheme] = tactical / self.pilot_samples
+
+            if tva.options <= MAX_TABLE_CANDIDATES:
+                search = tva.get_block_search(scheme)
+                coalition = tuple(range(k))
+                # the first search fills the caches of the scheme
+                for _ in range(2):
+                    start = time.perf_counter()
+                    search(coalition)
+                enumeration += time.perf_counter() - start
+
+            if k == 1:
+                start = time.perf_counter()
+                solver = ManipulationSolver(tva.situation, scheme, bullet, func)
+                solver.best_response(0)
+                self._solve_costs[scheme] = time.perf_counter() - start
+        self._sample_cost = sampling / (self.pilot_samples * len(VotingScheme))
+        # enumeration needs the permutation table
+        self._block_cost = None
+        if tva.options <= MAX_TABLE_CANDIDATES:
+            self._block_cost = enumeration / len(VotingScheme)
+
+        # the new overall happiness of each tactical voting
+        matrix = tva.situation.voting_matrix
+        outcome = IncrementalTally(tva.situation, scheme).outcome
+        start = time.perf_counter()
+        Happiness.evaluate(matrix.T, outcome[None, :], func)
+        self._record_cost = time.perf_counter() - start
+
+    def _estimate(self, engine: str) -> Dict:
+        """
+        Args:
+            engine (str): one of the engines
+
+        Returns:
+            Dictionary with the number of evaluations, the peak memory in
+            bytes, the time in seconds, whether they fit the budget and a
+            note
+        """
+        tva = self.tva
+        k = tva.coalition_size
+        m = tva.options
+        schemes = len(VotingScheme)
+        analyses = self._analyses
+        votings = tva.alternative_votings
+        itemsize = tva.situation.voting_matrix.itemsize
+
+        # blocks of votings evaluated at once: ballots, outcomes, happiness
+        # and their temporaries
+        block = min(votings, tva.block_size)
+        block_memory = block * (3 * k * m * itemsize + 3 * m * 8 + 3 * k * 8)
+        # risks of each coalition, as array and as list
+        risks_memory = analyses * schemes * self._coalitions * (8 + self._int_bytes)
+        # a tactical voting: tuple of 6, member ballots, outcome, 2 arrays
+        record_bytes = (
+            self._list_bytes
+            + 6 * 8
+            + k * (self._list_bytes + 8 * m)
+            + self._list_bytes
+            + m * (8 + self._float_bytes)
+            + 2 * (self._array_bytes + 8 * k)
+            + 2 * self._float_bytes
+        )
+        records = analyses * sum(
+            self._coalitions * votings * rate for rate in self._tactical_rates.values()
+        )
+        evaluations = schemes * self._groups * votings
+        note = ""
+
+        if engine in ("exact", "pruned"):
+            if self._block_cost is None:
+                return self._result(
+                    evaluations, None, None, False, "too many candidates to enumerate"
+                )
+            search = (
+                schemes * self._groups * math.ceil(votings / block) * self._block_cost
+            )
+        if engine == "exact":
+            memory = (
+                block_memory
+                + risks_memory
+                + analyses * schemes * self._coalitions * self._list_bytes
+                + records * record_bytes
+            )
+            duration = search + records * self._record_cost
+            if not self.records:
+                return self._result(evaluations, memory, duration, False, "not needed")
+        elif engine == "pruned":
+            memory = block_memory + risks_memory
+            duration = search
+            note = "exact risks, no tactical votings"
+        elif engine == "solver":
+            if k != 1:
+                return self._result(None, None, None, False, "single voters only")
+            evaluations = analyses * self._types * schemes
+            # one tactical voting at most for each voter
+            records = analyses * schemes * tva.voters
+            memory = risks_memory + records * record_bytes
+            duration = (
+                analyses * self._types * sum(self._solve_costs.values())
+                + records * self._record_cost
+            )
+            note = "exact boolean risk (lower bound for BORDA), no average risk"
+        else:
+            z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+            # samples for the target width, with the measured rate
+            samples = analyses * sum(
+                math.ceil(
+                    4 * z**2 * max(rate * (1 - rate), 1 / 16) / self.target_width**2
+                )
+                for rate in self._tactical_rates.values()
+            )
+            # coalitions searched for the boolean risk, at worst to the end
+            coalitions = analyses * schemes * math.ceil(z**2 / self.target_width**2)
+            if votings <= tva.max_search_votings:
+                search_cost = math.ceil(votings / block) * self._block_cost
+            elif k == 1:
+                search_cost = sum(self._solve_costs.values()) / schemes
+            else:
+                search_cost = 0
+                note = "no boolean risk: too many votings to search"
+            evaluations = samples + coalitions * min(votings, tva.max_search_votings)
+            memory = tva.sample_size * k * m * 8 * 6 + block_memory
+            duration = samples * self._sample_cost + coalitions * search_cost
+            if self.time_budget is not None and duration > self.time_budget:
+                # the sampling stops at the budget with wider intervals
+                duration = self.time_budget
+                note = "stops at the time budget, intervals wider than the target"
+            return self._result(evaluations, memory, duration, True, note)
+
+        return self._result(evaluations, memory, duration, True, note)
+
+    def _result(
+        self,
+        evaluations: Optional[float],
+        memory: Optional[float],
+        duration: Optional[float],
+        possible: bool,
+        note: str,
+    ) -> Dict:
+        """
+        Args:
+            evaluations (float): number of votings evaluated
+            memory (float): peak memory in bytes
+            duration (float): time in seconds
+            possible (bool): whether the engine can be used
+            note (str): note for the report
+
+        Returns:
+            The estimates of an engine, see _estimate
+        """
+        fits = possible
+        if fits and self.memory_budget is not None:
+            fits = memory <= self.memory_budget
+        if fits and self.time_budget is not None:
+            fits = duration <= self.time_budget
+        return {
+            "evaluations": evaluations,
+            "memory": memory,
+            "time": duration,
+            "fits": fits,
+            "note": note,
+        }
+
+
+def _format_bytes(amount: Optional[float]) -> str:
+    """
+    Args:
+        amount (float): bytes
+
+    Returns:
+        The amount with a binary unit, "-" for None
+    """
+    if amount is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if amount < 1024:
+            return f"{amount:.1f} {unit}"
+        amount /= 1024
+    return f"{amount:.1f} TiB"
+
+
+def _format_time(seconds: Optional[float]) -> str:
+    """
+    Args:
+        seconds (float): duration
+
+    Returns:
+        The duration with a unit, "-" for None
+    """
+    if seconds is None:
+        return "-"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.1f} ms"
+    if seconds < 3600:
+        return f"{seconds:.1f} s"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} days"
+
+
+if __name__ == "__main__":
+    np.random.seed(42)
+    for voters, candidates, coalition in ((15, 4, 1), (50, 6, 2), (1000, 12, 1)):
+        print("-" * 80)
+        planner = RiskPlanner(
+            TacticalVotingRisk(voters, candidates, coalition),
+            memory_budget=2**30,
+            time_budget=60,
+        )
+        print(planner.explain())
@@ -3,15 +3,39 @@ This module is for computing the risk of tacitcal voting.
 
 It contains:
     * TacticalVotingRisk: class that compute the risk for each scheme
+    * RiskCounter: counters of the tactical votings of each coalition
+    * RiskEstimate: risk estimated by sampling, with its confidence interval
 """
-from itertools import permutations, product, combinations
-from typing import Optional, List, Tuple
+from collections import OrderedDict
+from itertools import combinations
+from statistics import NormalDist
+from types import MethodType
+from typing import Optional, List, Tuple, Dict, Any, Callable, Iterable, Iterator, Union
+import contextlib
 import math
+import time
+import multiprocessing
+import multiprocessing.pool
 import numpy as np
 
-from VotingSituation import VotingSituation
-from Vot_Scheme import VotingScheme
-from Happiness import Happiness
+from VotingSituation import (
+    VotingSituation,
+    IncrementalTally,
+    MultiSchemeTally,
+    SharedVotingMatrix,
+    ballot_votes,
+    scheme_votes,
+)
+from Vot_Scheme import VotingScheme, compute_vot_scheme, compute_ballot_classes
+from Happiness import Happiness, HappinessCache
+from BallotEnumeration import (
+    MAX_TABLE_CANDIDATES,
+    BallotEnumerator,
+    build_votings,
+    get_bullet_votings,
+    get_permutation_table,
+)
+from ManipulationSolver import ManipulationSolver
 
 
 class TacticalVotingRisk:
@@ -33,21 +57,47 @@ class TacticalVotingRisk:
         "noh": 4,
         "old_overall_happiness": 5,
         "ooh": 5,
+        "family": 6,
+        "f": 6,
     }
 
+    # number of votings of a coalition evaluated at once
+    block_size = 2**16
+    # number of multisets of voter types whose tactical votings are kept
+    max_cached_groups = 2**10
+
+    # number of (coalition, voting) pairs drawn at once by estimate_risk
+    sample_size = 2**12
+    # number of coalitions searched at once by estimate_risk
+    coalition_sample_size = 16
+    # largest number of votings of a coalition searched by estimate_risk
+    max_search_votings = 10**7
+
+    # key: (scheme, candidates, position weight),
+    # values: (permutations, vote deltas, happiness weights)
+    _gain_tables: Dict[Tuple, Tuple[np.array, np.array, np.array]] = {}
+
     def __init__(
         self,
         voters: int = 0,
         candidates: int = 0,
         advance_voters_coalition: int = 1,
         situation: Optional[VotingSituation] = None,
-        allow_bullet_voting=False,
+        allow_bullet_voting: Union[bool, str] = False,
+        workers: Optional[int] = None,
+        happiness_functions: Optional[List[Callable]] = None,
+        happiness_cache_size: int = 2**8,
     ) -> None:
         """
         Compute the risk of tactical voting for 1 voting situation
 
         If a VotingSituation is not given a new one is created.
 
+        In a situation stored as a histogram (see
+        VotingSituation.from_histogram) each distinct preference is analysed
+        once and its tactical votings are shared by all its voters. Coalitions
+        are analysed on the expanded situation.
+
         keys: dictionary to interpret the results
         Args:
             voters (int): number of voters.
@@ -55,23 +105,50 @@ class TacticalVotingRisk:
             advance_voters_coalition (int): for the advance tactical voting,
                 make coalitions of this size.
             situation (Optional - VotingSituation): given situation
-            allow_bullet_voting (bool): whether
+            allow_bullet_voting (bool or str): whether the voters can do
+                bullet voting. "both" analyses the situation with and without
+                bullet voting in the same search, see compute_risk
+            workers (Optional - int): number of processes used to search the
+                coalitions, by default the search is serial
+            happiness_functions (Optional - List[Callable]): happiness
+                functions of Happiness used by compute_risk, all evaluated in
+                the same search. By default get_voter_happiness.
+            happiness_cache_size (int): number of outcomes whose happiness
+                of the voters is kept, see HappinessCache
         """
-        self._bullet = allow_bullet_voting
+        if allow_bullet_voting == "both":
+            # the votings without bullet voting are a subset of the others
+            self._variants = [True, False]
+        else:
+            self._variants = [bool(allow_bullet_voting)]
+        self._bullet = self._variants[0]
+        self._workers = workers
+        if happiness_functions is None:
+            happiness_functions = [Happiness.get_voter_happiness]
+        self._happiness_functions = list(happiness_functions)
 
         # Create new sitiation if not give
         if situation is not None:
             self.situation = situation
         else:
             self.situation = VotingSituation(voters, candidates)
+        if self.situation.counts is not None and advance_voters_coalition != 1:
+            self.situation = self.situation.expand()
 
         # Get number of voter and candidates
-        self.options, self.voters = self.situation.voting_matrix.shape
+        self.options = self.situation.voting_matrix.shape[0]
+        self.voters = self.situation.voter_am
 
         # Compute the number of alternative preferences (exclude honest pref.)
         self.alternative_votings = math.factorial(self.options) - 1
         if self._bullet:
             self.alternative_votings += self.options
+        self._member_votings = self.alternative_votings
+
+        # alternative votings of a coalition without bullet voting
+        self._permutation_votings = (
+            math.factorial(self.options) - 1
+        ) ** advance_voters_coalition
 
         if advance_voters_coalition != 1:
             # Cartesian product
@@ -79,97 +156,725 @@ class TacticalVotingRisk:
 
         self._coalition = advance_voters_coalition
 
-    def compute_risk(self) -> Tuple[List, List[int], float, float]:
+        # happiness of the honest voters under the outcomes of the tactical
+        # votings, shared by all the coalitions and schemes
+        self.happiness_cache = HappinessCache(
+            self.situation.voting_matrix, happiness_cache_size
+        )
+
+        # type of each voter: index of its preference among the distinct ones
+        self._voter_types = np.unique(
+            self.situation.voting_matrix, axis=1, return_inverse=True
+        )[1].reshape(-1)
+
+    def compute_risk(
+        self,
+        mode: Optional[str] = "records",
+        schemes: Optional[Iterable[VotingScheme]] = None,
+    ) -> Tuple[List, List[int], float, float]:
         """
         Count how many tactival votes each voter has
 
+        In "records" and "counts" mode the schemes are evaluated together,
+        serially or with the pool of workers: the alternative votings of each
+        coalition are enumerated once and scored under every scheme (see
+        MultiSchemeTally).
+
+        Each happiness function of the analysis is evaluated on the outcomes
+        of the same search (or solved and estimated for each of them). With
+        more than one function the results are given for each of them, keyed
+        by the name of the function.
+
+        When allow_bullet_voting is "both" the votings with bullet voting are
+        enumerated once and the results are given for the analysis with
+        bullet voting ("bullet") and without ("no_bullet"), each with its
+        own amount of alternative votings. Each tactical vote has an extra
+        "family" field: "bullet" if a member does bullet voting, otherwise
+        "permutation". The solver and estimate_risk also give both variants.
+
+        Args:
+            mode (str): "records" to return every tactical vote, "counts" to
+                only count them. In "counts" mode the tactical votes and the
+                new overall happiness are not computed and the detailed tv
+                in the results is None. "solver" to build at most one
+                tactical vote for each voter without enumerating the ballots
+                (see solve_tactical_votes), for many candidates: the number
+                of tv of a voter is 0 or 1 and the average risk is None.
+            schemes (Optional - Iterable[VotingScheme]): schemes to analyse,
+                all of them by default
+
         Returns:
             Tuple containing the detailed tv, the number of tv for each voters,
             the average risk and boolean risk.
 
         Note: the return object is a deeply nested structure
         """
-        # key: scheme, values: (data, risks, avg_risk, avg_bool_risk)
-        results = {}
-        for scheme in VotingScheme:
-            res, risk = self._compute_risk_coalitions(scheme)
-            tmp = np.array(risk)
-            avg_risk = np.sum(tmp) / (
-                self.alternative_votings * math.comb(self.voters, self._coalition)
+        if mode not in ("records", "counts", "solver"):
+            raise ValueError(
+                f"Unknown mode {mode}, use 'records', 'counts' or 'solver'"
             )
-            avg_bool_risk = np.sum(tmp > 0) / math.comb(self.voters, self._coalition)
-            results[scheme.name] = (res, risk, avg_risk, avg_bool_risk)
+        schemes = list(VotingScheme) if schemes is None else list(schemes)
 
-        return results
+        if mode != "solver":
+            with self._worker_pool() as pool:
+                return self._compute_risk_schemes(schemes, mode == "counts", pool=pool)
 
-    def _compute_risk_no_coalitions(
-        self, scheme_type: VotingScheme, verbose: Optional[bool] = True
-    ) -> Tuple[List[List[Tuple]], List[int]]:
+        results = []
+        for bullet in self._variants:
+            for func in self._happiness_functions:
+                for scheme in schemes:
+                    counter = self.get_risk_counter(bullet)
+                    res = [[] for i in counter.risks]
+                    for n, tv in self.solve_tactical_votes(
+                        scheme, counter, happiness_func=func, bullet=bullet
+                    ):
+                        res[n].append(tv)
+                    results.append(
+                        (
+                            scheme,
+                            func,
+                            bullet,
+                            (res, counter.risks.tolist(), None, counter.avg_bool_risk),
+                        )
+                    )
+
+        return self._nest_results(results)
+
+    def get_risk_counter(self, bullet: Optional[bool] = None) -> "RiskCounter":
+        """
+        Args:
+            bullet (Optional - bool): whether the analysis allows bullet
+                voting, by default as the search
+
+        Returns:
+            Empty counters for the coalitions of this analysis
+        """
+        if bullet is None or bullet == self._bullet:
+            alternative_votings = self.alternative_votings
+        else:
+            alternative_votings = self._permutation_votings
+        return RiskCounter(
+            math.comb(self.voters, self._coalition), alternative_votings
+        )
+
+    @property
+    def coalition_size(self) -> int:
+        """
+        Returns:
+            Number of voters of each coalition
+        """
+        return self._coalition
+
+    @property
+    def variants(self) -> List[bool]:
+        """
+        Returns:
+            Whether bullet voting is allowed, for each variant of the analysis
+        """
+        return list(self._variants)
+
+    @property
+    def happiness_functions(self) -> List[Callable]:
+        """
+        Returns:
+            Happiness functions of the analysis
+        """
+        return list(self._happiness_functions)
+
+    @property
+    def preference_types(self) -> int:
+        """
+        Returns:
+            Number of distinct preferences of the voters
+        """
+        return int(self._voter_types.max()) + 1
+
+    def get_tactical_sampler(
+        self,
+        scheme_type: VotingScheme,
+        happiness_func: Optional[Callable] = None,
+        bullet: Optional[bool] = None,
+    ) -> Callable[[np.random.Generator, int], int]:
+        """
+        Args:
+            scheme_type (VotingScheme): scheme used to compute the outcome.
+            happiness_func (Optional - Callable): happiness function, by
+                default the first one of the analysis
+            bullet (Optional - bool): whether bullet voting is allowed, by
+                default as the search
+        Returns:
+            Function that draws the given number of (coalition, voting) pairs
+            with the random generator and counts the tactical ones, see
+            estimate_risk
+        """
+        multi, analyses = self._get_analysis(scheme_type, False, happiness_func, bullet)
+        _, happiness_func, original_happiness, bullet = analyses[0]
+
+        def sample(rng: np.random.Generator, size: int) -> int:
+            return self._sample_tactical_votings(
+                multi.tallies[0], original_happiness, rng, size, happiness_func, bullet
+            )
+
+        return sample
+
+    def get_block_search(
+        self, scheme_type: VotingScheme
+    ) -> Callable[[Tuple[int]], int]:
+        """
+        Args:
+            scheme_type (VotingScheme): scheme used to compute the outcome.
+        Returns:
+            Function that searches the first block of alternative votings of a
+            coalition (voters numbered as the columns of the voting matrix)
+            for every happiness function and variant, as compute_risk, and
+            counts the tactical votings
+        """
+        multi, analyses = self._get_analyses([scheme_type], False)
+
+        def search(c: Tuple[int]) -> int:
+            block = next(self._search_coalition(multi, analyses, c))
+            return sum(len(indices) for indices, *_ in block)
+
+        return search
+
+    def iter_tactical_votes(
+        self,
+        scheme_type: VotingScheme,
+        counter: Optional["RiskCounter"] = None,
+        verbose: Optional[bool] = True,
+        pool: Optional[multiprocessing.pool.Pool] = None,
+        happiness_func: Optional[Callable] = None,
+        bullet: Optional[bool] = None,
+    ) -> Iterator[Tuple[int, Tuple]]:
+        """
+        Find the tactical votings of every coalition, one at the time
+
+        The tactical votings are yielded as soon as the search of their
+        coalition ends, so the memory used does not grow with the amount of
+        results. Callers that only need the risks can just count them:
+
+            counter = tva.get_risk_counter()
+            for _ in tva.iter_tactical_votes(scheme, counter):
+                pass
+            print(counter.avg_risk, counter.avg_bool_risk)
+
+        Args:
+            scheme_type (VotingScheme): scheme used to compute the outcome.
+            counter (Optional - RiskCounter): counters updated with the
+                amount of tactical votings of each coalition
+            verbose (bool): print information about the original happiness
+            pool (Optional - Pool): pool from _worker_pool, by default a
+                new one is opened if workers are used
+            happiness_func (Optional - Callable): happiness function of the
+                voters, by default the first one of the analysis
+            bullet (Optional - bool): whether bullet voting is allowed, by
+                default as the search
+        Yields:
+            Index of the coalition (in the order of itertools.combinations)
+            and tactical voting, see _compute_risk_coalitions.
         """
-        Compute the risk
+        multi, analyses = self._get_analysis(
+            scheme_type, verbose, happiness_func, bullet
+        )
+
+        for coalitions, (result,) in self._iter_results(multi, analyses, verbose, pool):
+            if counter is not None:
+                counter.add(coalitions, len(result))
+            for n in range(coalitions.start, coalitions.stop):
+                for tv in result:
+                    yield n, tv
+
+    def count_tactical_votes(
+        self,
+        scheme_type: VotingScheme,
+        counter: Optional["RiskCounter"] = None,
+        verbose: Optional[bool] = True,
+        pool: Optional[multiprocessing.pool.Pool] = None,
+        happiness_func: Optional[Callable] = None,
+        bullet: Optional[bool] = None,
+    ) -> "RiskCounter":
+        """
+        Count the tactical votings of every coalition without building them
 
         Args:
             scheme_type (VotingScheme): scheme used to compute the outcome.
+            counter (Optional - RiskCounter): counters to update, by default
+                new ones are created
             verbose (bool): print information about the original happiness
+            pool (Optional - Pool): pool from _worker_pool, by default a
+                new one is opened if workers are used
+            happiness_func (Optional - Callable): happiness function of the
+                voters, by default the first one of the analysis
+            bullet (Optional - bool): whether bullet voting is allowed, by
+                default as the search
         Returns:
-            result (list), risks (list): list containing the tactical votings
-            and the number of possible tactical votes for each voters.
-            For both lists the index represent the voters.
-            The result list contain a list of tactical votings for each voters.
-            Each tactical vote is a tuple containing the new preference, the
-            new outcome, the new individual happines, the old individual happines,
-            the new overall happiness, the old overall happines.
+            The counters with the amount of tactical votings of each coalition
         """
-        original_outcome = self.situation.calculatevote(scheme_type)
-        original_happiness = Happiness(self.situation.voting_matrix, original_outcome)
+        if counter is None:
+            counter = self.get_risk_counter(bullet)
+        multi, analyses = self._get_analysis(
+            scheme_type, verbose, happiness_func, bullet
+        )
+
+        for coalitions, (count,) in self._iter_results(
+            multi, analyses, verbose, pool, True
+        ):
+            counter.add(coalitions, count)
+        return counter
+
+    def solve_tactical_votes(
+        self,
+        scheme_type: VotingScheme,
+        counter: Optional["RiskCounter"] = None,
+        verbose: Optional[bool] = True,
+        happiness_func: Optional[Callable] = None,
+        bullet: Optional[bool] = None,
+    ) -> Iterator[Tuple[int, Tuple]]:
+        """
+        Find one tactical voting for each voter with the ManipulationSolver,
+        without enumerating the alternative ballots.
+
+        The voters with the same preference are solved once. The solver is
+        exact for VOTE_FOR_ONE, VOTE_FOR_TWO and VETO with a happiness
+        linear in the outcome (get_voter_happiness and
+        get_voter_happiness_dictatorship), so the boolean risk is the one of
+        the exhaustive search. Otherwise it uses a local search and the
+        boolean risk is a lower bound.
+
+        Args:
+            scheme_type (VotingScheme): scheme used to compute the outcome.
+            counter (Optional - RiskCounter): counters updated with 1 for
+                each voter with a tactical voting
+            verbose (bool): print information about the original happiness
+            happiness_func (Optional - Callable): happiness function of the
+                voters, by default the first one of the analysis
+            bullet (Optional - bool): whether bullet voting is allowed, by
+                default as the search
+        Yields:
+            Index of the voter and its tactical voting, see
+            _compute_risk_coalitions. When both bullet voting variants are
+            analysed it has its family as an extra field.
+        """
+        if self._coalition != 1:
+            raise ValueError("The solver only finds tactical votings of single voters")
+
+        multi, analyses = self._get_analysis(
+            scheme_type, verbose, happiness_func, bullet
+        )
+        tally = multi.tallies[0]
+        _, happiness_func, original_happiness, bullet = analyses[0]
+        solver = ManipulationSolver(self.situation, scheme_type, bullet, happiness_func)
+        counts = self.situation.counts
+
+        # key: voter type, values: tactical voting found for the type
+        found = {}
+        stop = 0
+        for column, voter_type in enumerate(self._voter_types.tolist()):
+            start = stop
+            stop += 1 if counts is None else int(counts[column])
+            if voter_type not in found:
+                found[voter_type] = solver.find_tactical_voting(column)
+            if found[voter_type] is None:
+                continue
+
+            ballot, new_outcome, new_happiness = found[voter_type]
+            result = self._evaluate_coalition(
+                tally,
+                original_happiness,
+                (column,),
+                (
+                    None,
+                    ballot[None, None],
+                    new_outcome[None],
+                    np.array([[new_happiness]]),
+                ),
+                happiness_func,
+            )
+            if len(self._variants) > 1:
+                result = [tv + (self._get_family(tv),) for tv in result]
+            if counter is not None:
+                counter.add(slice(start, stop), len(result))
+            for n in range(start, stop):
+                for tv in result:
+                    yield n, tv
+
+    def estimate_risk(
+        self,
+        target_width: Optional[float] = 0.02,
+        time_budget: Optional[float] = None,
+        confidence: Optional[float] = 0.95,
+        max_samples: Optional[int] = 10**6,
+        seed: Optional[int] = None,
+        verbose: Optional[bool] = True,
+    ) -> Dict[str, Tuple]:
+        """
+        Estimate the risks by sampling, when there are too many votings to
+        enumerate them
+
+        The average risk is estimated from (coalition, alternative voting)
+        pairs drawn uniformly from the ones compute_risk enumerates. The
+        boolean risk is estimated from random coalitions, each searched until
+        its first tactical voting. Single voters with too many votings are
+        searched with the ManipulationSolver (a lower bound for BORDA).
+
+        Each happiness function and bullet voting variant of the analysis is
+        estimated with its own samples. The sampling of a scheme stops when
+        both confidence intervals are narrower than target_width, after
+        time_budget seconds or after max_samples samples for each risk.
+
+        Args:
+            target_width (Optional - float): width of the confidence intervals
+            time_budget (Optional - float): seconds of sampling for each
+                scheme, happiness function and bullet voting variant
+            confidence (float): confidence level of the intervals
+            max_samples (Optional - int): maximum samples for each risk
+            seed (Optional - int): seed of the samples
+            verbose (bool): print information about the original happiness
+        Returns:
+            Results in the same shape as compute_risk: the detailed tv and the
+            number of tv for each voter are None, the average risk and boolean
+            risk are RiskEstimate. The boolean risk is None if the coalitions
+            have too many votings to be searched.
+        """
+        if target_width is None and time_budget is None and max_samples is None:
+            raise ValueError("Give a target width, a time budget or max samples")
+
+        rng = np.random.default_rng(seed)
+        results = []
+        for bullet in self._variants:
+            for func in self._happiness_functions:
+                for scheme in VotingScheme:
+                    results.append(
+                        (
+                            scheme,
+                            func,
+                            bullet,
+                            self._estimate_scheme_risk(
+                                scheme,
+                                func,
+                                bullet,
+                                rng,
+                                target_width,
+                                time_budget,
+                                confidence,
+                                max_samples,
+                                verbose,
+                            ),
+                        )
+                    )
+
+        return self._nest_results(results)
+
+    def _estimate_scheme_risk(
+        self,
+        scheme_type: VotingScheme,
+        happiness_func: Callable,
+        bullet: bool,
+        rng: np.random.Generator,
+        target_width: Optional[float],
+        time_budget: Optional[float],
+        confidence: float,
+        max_samples: Optional[int],
+        verbose: Optional[bool] = True,
+    ) -> Tuple[None, None, "RiskEstimate", Optional["RiskEstimate"]]:
+        """
+        Estimate the risks of one scheme, happiness function and bullet
+        voting variant, see estimate_risk
+
+        Args:
+            scheme_type (VotingScheme): scheme used to compute the outcome.
+            happiness_func (Callable): happiness function of the voters
+            bullet (bool): whether bullet voting is allowed
+            rng (Generator): random generator
+            target_width (Optional - float): width of the confidence intervals
+            time_budget (Optional - float): seconds of sampling
+            confidence (float): confidence level of the intervals
+            max_samples (Optional - int): maximum samples for each risk
+            verbose (bool): print information about the original happiness
+        Returns:
+            The result of the scheme, see estimate_risk
+        """
+        multi, analyses = self._get_analysis(
+            scheme_type, verbose, happiness_func, bullet
+        )
+        tally = multi.tallies[0]
+        original_happiness = analyses[0][2]
+        has_tactical_voting = self._get_coalition_search(multi, analyses)
+
+        # tactical and total samples of each risk
+        samples = {"risk": [0, 0], "bool_risk": [0, 0]}
+        if has_tactical_voting is None:
+            del samples["bool_risk"]
+        start = time.monotonic()
+        while True:
+            estimates = {
+                key: RiskEstimate(*counts, confidence)
+                for key, counts in samples.items()
+            }
+            pending = [
+                key
+                for key, estimate in estimates.items()
+                if (target_width is None or not estimate.width <= target_width)
+                and (max_samples is None or estimate.samples < max_samples)
+            ]
+            if not pending:
+                break
+            if time_budget is not None and time.monotonic() - start > time_budget:
+                break
+
+            if "risk" in pending:
+                samples["risk"][0] += self._sample_tactical_votings(
+                    tally,
+                    original_happiness,
+                    rng,
+                    self.sample_size,
+                    happiness_func,
+                    bullet,
+                )
+                samples["risk"][1] += self.sample_size
+            if "bool_risk" in pending:
+                coalitions = self._voter_columns(
+                    self._sample_coalitions(rng, self.coalition_sample_size)
+                )
+                samples["bool_risk"][0] += sum(
+                    has_tactical_voting(tuple(c)) for c in coalitions.tolist()
+                )
+                samples["bool_risk"][1] += self.coalition_sample_size
+
+        if verbose:
+            print("Estimated risk = ", repr(estimates["risk"]))
+            print("Estimated bool risk = ", repr(estimates.get("bool_risk")))
+        return None, None, estimates["risk"], estimates.get("bool_risk")
+
+    def _sample_coalitions(self, rng: np.random.Generator, size: int) -> np.array:
+        """
+        Args:
+            rng (Generator): random generator
+            size (int): number of coalitions
+
+        Returns:
+            Coalitions drawn uniformly, the voters of each sorted (size x k)
+        """
+        coalitions = np.sort(
+            rng.integers(0, self.voters, size=(size, self._coalition)), axis=1
+        )
+        # draw again the coalitions with a voter more than once
+        repeated = np.any(coalitions[:, 1:] == coalitions[:, :-1], axis=1)
+        while np.any(repeated):
+            coalitions[repeated] = np.sort(
+                rng.integers(0, self.voters, size=(np.sum(repeated), self._coalition)),
+                axis=1,
+            )
+            repeated = np.any(coalitions[:, 1:] == coalitions[:, :-1], axis=1)
+        return coalitions
+
+    def _voter_columns(self, voters: np.array) -> np.array:
+        """
+        Args:
+            voters (np.array): indices of voters
+
+        Returns:
+            Column of the voting matrix of each voter, the voters of a
+            situation stored as a histogram are numbered column by column
+        """
+        if self.situation.counts is None:
+            return voters
+        return np.searchsorted(np.cumsum(self.situation.counts), voters, side="right")
+
+    def _sample_tactical_votings(
+        self,
+        tally: IncrementalTally,
+        original_happiness: Happiness,
+        rng: np.random.Generator,
+        size: int,
+        happiness_func: Callable = Happiness.get_voter_happiness,
+        bullet: Optional[bool] = None,
+    ) -> int:
+        """
+        Args:
+            tally (IncrementalTally): honest outcome of the scheme
+            original_happiness (Happiness): honest happiness
+            rng (Generator): random generator
+            size (int): number of (coalition, voting) pairs to draw
+            happiness_func (Callable): happiness function of the voters
+            bullet (Optional - bool): whether bullet voting is allowed, by
+                default as the search
+
+        Returns:
+            Number of pairs where the voting is tactical for the coalition
+        """
+        coalitions = self._voter_columns(self._sample_coalitions(rng, size))
+        # the bullet votings are numbered after the permutations
+        member_votings = self._member_votings
+        if bullet is not None and bullet != self._bullet:
+            member_votings = math.factorial(self.options) - 1
+        members = rng.integers(0, member_votings, size=coalitions.shape)
+        honest = self.situation.voting_matrix.T[coalitions]
+        tv_ballots = build_votings(honest, members)
+
+        # outcomes updated from the honest one, B x m
+        new_outcomes = (
+            tally.outcome
+            - ballot_votes(tally.scheme_vector, honest.transpose(0, 2, 1), self.options)
+            + ballot_votes(
+                tally.scheme_vector, tv_ballots.transpose(0, 2, 1), self.options
+            )
+        )
+        new_coalition_happiness = Happiness.evaluate(
+            tv_ballots, new_outcomes[:, None, :], happiness_func
+        )
+        tactical = np.all(
+            new_coalition_happiness
+            > original_happiness.individual_happiness[coalitions],
+            axis=1,
+        )
+        return int(np.sum(tactical))
+
+    def _get_coalition_search(
+        self,
+        multi: MultiSchemeTally,
+        analyses: List[Tuple[int, Callable, Happiness, bool]],
+    ) -> Optional[Callable[[Tuple[int]], bool]]:
+        """
+        Args:
+            multi (MultiSchemeTally): honest outcome of the scheme
+            analyses (List[Tuple[int, Callable, Happiness, bool]]): the
+                single analysis of the scheme, see _get_analysis
+
+        Returns:
+            Function that tells whether a coalition has a tactical voting,
+            None if the coalitions have too many votings to be searched
+        """
+        if self.alternative_votings <= self.max_search_votings:
+
+            def has_tactical_voting(c: Tuple[int]) -> bool:
+                return any(
+                    len(block[0][0])
+                    for block in self._search_coalition(multi, analyses, c)
+                )
+
+            return has_tactical_voting
+
+        if self._coalition == 1:
+            _, happiness_func, _, bullet = analyses[0]
+            solver = ManipulationSolver(
+                self.situation, multi.voting_schemes[0], bullet, happiness_func
+            )
+            return lambda c: solver.find_tactical_voting(c[0]) is not None
+        return None
+
+    def _get_analyses(
+        self,
+        schemes: List[VotingScheme],
+        verbose: Optional[bool] = True,
+        functions: Optional[List[Callable]] = None,
+        variants: Optional[List[bool]] = None,
+    ) -> Tuple[MultiSchemeTally, List[Tuple[int, Callable, Happiness, bool]]]:
+        """
+        Args:
+            schemes (List[VotingScheme]): schemes to analyse
+            verbose (bool): print information about the original happiness
+            functions (Optional - List[Callable]): happiness functions, by
+                default the ones of the analysis
+            variants (Optional - List[bool]): whether bullet voting is
+                allowed, for each variant, by default the ones of the analysis
+        Returns:
+            The honest outcomes of the schemes and, for each analysis, the
+            index of the scheme, happiness function, honest happiness and
+            whether bullet voting is allowed
+        """
+        if functions is None:
+            functions = self._happiness_functions
+        if variants is None:
+            variants = self._variants
+        if any(variants) and not self._bullet:
+            raise ValueError("The bullet votings are not enumerated by this analysis")
+
+        multi = MultiSchemeTally(self.situation, schemes)
+        # key: (scheme, happiness function), values: honest happiness
+        honest = {
+            (s, func): self._get_honest_state(
+                scheme, verbose, multi.tallies[s], func
+            )[1]
+            for func in functions
+            for s, scheme in enumerate(schemes)
+        }
+        analyses = [
+            (s, func, happiness, bullet)
+            for bullet in variants
+            for (s, func), happiness in honest.items()
+        ]
+        return multi, analyses
+
+    def _get_analysis(
+        self,
+        scheme_type: VotingScheme,
+        verbose: Optional[bool] = True,
+        happiness_func: Optional[Callable] = None,
+        bullet: Optional[bool] = None,
+    ) -> Tuple[MultiSchemeTally, List[Tuple[int, Callable, Happiness, bool]]]:
+        """
+        Args:
+            scheme_type (VotingScheme): scheme used to compute the outcome.
+            verbose (bool): print information about the original happiness
+            happiness_func (Optional - Callable): happiness function of the
+                voters, by default the first one of the analysis
+            bullet (Optional - bool): whether bullet voting is allowed, by
+                default as the search
+        Returns:
+            The single analysis of one scheme, see _get_analyses
+        """
+        if happiness_func is None:
+            happiness_func = self._happiness_functions[0]
+        if bullet is None:
+            bullet = self._bullet
+        return self._get_analyses([scheme_type], verbose, [happiness_func], [bullet])
+
+    def _get_honest_state(
+        self,
+        scheme_type: VotingScheme,
+        verbose: Optional[bool] = True,
+        tally: Optional[IncrementalTally] = None,
+        happiness_func: Callable = Happiness.get_voter_happiness,
+    ) -> Tuple[IncrementalTally, Happiness]:
+        """
+        Args:
+            scheme_type (VotingScheme): scheme used to compute the outcome.
+            verbose (bool): print information about the original happiness
+            tally (Optional - IncrementalTally): honest outcome of the
+                scheme, by default it is computed
+            happiness_func (Callable): happiness function of the voters
+        Returns:
+            The honest outcome of the scheme and the honest happiness
+        """
+        if tally is None:
+            tally = IncrementalTally(self.situation, scheme_type)
+        original_outcome = tally.outcome
+        original_happiness = Happiness(
+            self.situation.voting_matrix, original_outcome, self.situation.counts
+        )
+        if happiness_func is not Happiness.get_voter_happiness:
+            happiness_func = getattr(happiness_func, "__func__", happiness_func)
+            original_happiness.get_happiness(
+                self.situation.voting_matrix,
+                MethodType(happiness_func, original_happiness),
+            )
 
         if verbose:
             print("--------------")
             print("Scheme = ", scheme_type)
+            if happiness_func is not Happiness.get_voter_happiness:
+                print("Happiness = ", happiness_func.__name__)
             print("Original outcome = ", original_outcome)
             print("Original happiness = ", original_happiness.happiness)
 
-        result = [
-            [None for j in range(self.alternative_votings)] for i in range(self.voters)
-        ]
-        risks = [0 for i in range(self.voters)]
-        for v in range(self.voters):
-            # compute permutations
-            voting = self.situation.voting_matrix.copy()
-            real_preference = voting[:, v]  # real preference of the voter
-            all_tv_preference = list(permutations(real_preference))[1:]
-
-            if self._bullet:
-                all_tv_preference.extend(self._get_bullet_votings())
-
-            # inspect each possible voting
-            for tv in all_tv_preference:
-                # change the voting matrix with the tactical vote
-                voting[:, v] = tv
-                new_outcome = self.situation.calculate_vote_given_matrix(
-                    scheme_type, voting
-                )
-                new_happiness = Happiness(voting, new_outcome)
-
-                # Tactical voting
-                if (
-                    new_happiness.individual_happiness[v]
-                    > original_happiness.individual_happiness[v]
-                ):
-                    result[v][risks[v]] = (
-                        tv,
-                        tuple(new_outcome),
-                        new_happiness.individual_happiness[v],
-                        original_happiness.individual_happiness[v],
-                        new_happiness.happiness,
-                        original_happiness.happiness,
-                    )
-                    risks[v] += 1
-        result = [[j for j in i if j is not None] for i in result]
-        return result, risks
+        return tally, original_happiness
 
     def _compute_risk_coalitions(
-        self, scheme_type: VotingScheme, verbose: Optional[bool] = True
+        self,
+        scheme_type: VotingScheme,
+        verbose: Optional[bool] = True,
+        pool: Optional[multiprocessing.pool.Pool] = None,
     ) -> Tuple[List[List[Tuple]], List[int]]:
         """
         Compute the risk including voters collusion
@@ -177,6 +882,8 @@ class TacticalVotingRisk:
         Args:
             scheme_type (VotingScheme): scheme used to compute the outcome.
             verbose (bool): print information about the original happiness
+            pool (Optional - Pool): pool from _worker_pool, by default a
+                new one is opened if workers are used
         Returns:
             result (list), risks (list): list containing the tactical votings
             and the number of possible tactical votes for each voters.
@@ -187,73 +894,945 @@ class TacticalVotingRisk:
             the new overall happiness, the old overall happines.
         """
 
-        original_outcome = self.situation.calculatevote(scheme_type)
-        original_happiness = Happiness(self.situation.voting_matrix, original_outcome)
+        counter = self.get_risk_counter()
+        result = [[] for i in counter.risks]
+        for n, tv in self.iter_tactical_votes(scheme_type, counter, verbose, pool):
+            result[n].append(tv)
+        return result, counter.risks.tolist()
 
-        if verbose:
-            print("--------------")
-            print("Scheme = ", scheme_type)
-            print("Original outcome = ", original_outcome)
-            print("Original happiness = ", original_happiness.happiness)
+    def _compute_risk_schemes(
+        self,
+        schemes: List[VotingScheme],
+        count_only: Optional[bool] = False,
+        verbose: Optional[bool] = True,
+        pool: Optional[multiprocessing.pool.Pool] = None,
+    ) -> Dict[str, Any]:
+        """
+        Compute the risk of many schemes, with every happiness function and
+        bullet voting variant, with a single enumeration of the alternative
+        votings of each coalition.
 
-        coalitions = list(combinations(range(self.voters), self._coalition))
-
-        result = [[None for j in range(self.alternative_votings)] for i in coalitions]
-        risks = [0 for i in coalitions]
-
-        for n, c in enumerate(coalitions):
-            # compute permutations
-            voting = self.situation.voting_matrix.copy()
-            real_preference = voting[:, c]  # real preference of the coalition
-
-            individual_preferences = [None for i in c]
-            for i, _ in enumerate(c):
-                individual_preferences[i] = list(permutations(real_preference[:, i]))[
-                    1:
-                ]
-                if self._bullet:
-                    individual_preferences[i].extend(self._get_bullet_votings())
-            all_tv_preference = list(product(*individual_preferences))
-
-            # inspect each possible voting
-            for tv in all_tv_preference:
-                # preference is should be a column vector
-                voting[:, c] = np.array(tv).T
-                new_outcome = self.situation.calculate_vote_given_matrix(
-                    scheme_type, voting
+        Args:
+            schemes (List[VotingScheme]): schemes to analyse
+            count_only (bool): only count the tactical votings
+            verbose (bool): print information about the original happiness
+            pool (Optional - Pool): pool from _worker_pool, by default a
+                new one is opened if workers are used
+        Returns:
+            The results of each scheme, see compute_risk
+        """
+        multi, analyses = self._get_analyses(schemes, verbose)
+
+        counters = [self.get_risk_counter(bullet) for *_, bullet in analyses]
+        data = [None if count_only else [[] for i in c.risks] for c in counters]
+        for coalitions, analysis_results in self._iter_results(
+            multi, analyses, verbose, pool, count_only
+        ):
+            for counter, res, result in zip(counters, data, analysis_results):
+                if count_only:
+                    counter.add(coalitions, result)
+                    continue
+                counter.add(coalitions, len(result))
+                for n in range(coalitions.start, coalitions.stop):
+                    res[n].extend(result)
+
+        results = []
+        for (s, func, _, bullet), counter, res in zip(analyses, counters, data):
+            results.append(
+                (
+                    schemes[s],
+                    func,
+                    bullet,
+                    (
+                        res,
+                        counter.risks.tolist(),
+                        counter.avg_risk,
+                        counter.avg_bool_risk,
+                    ),
                 )
-                new_happiness = Happiness(voting, new_outcome)
+            )
+        return self._nest_results(results)
+
+    def _nest_results(
+        self, results: List[Tuple[VotingScheme, Callable, bool, Tuple]]
+    ) -> Dict[str, Any]:
+        """
+        Args:
+            results (List[Tuple[VotingScheme, Callable, bool, Tuple]]): scheme,
+                happiness function, whether bullet voting is allowed and
+                result of each analysis
+
+        Returns:
+            The results keyed by the bullet voting variant ("bullet" or
+            "no_bullet") when both are analysed, then by the name of the
+            happiness function when there are many, then by the scheme
+        """
+        nested = {}
+        for scheme, func, bullet, result in results:
+            level = nested
+            if len(self._variants) > 1:
+                level = level.setdefault("bullet" if bullet else "no_bullet", {})
+            if len(self._happiness_functions) > 1:
+                level = level.setdefault(func.__name__, {})
+            level[scheme.name] = result
+        return nested
+
+    @staticmethod
+    def _get_family(tactical_voting: Tuple) -> str:
+        """
+        Args:
+            tactical_voting (Tuple): tactical voting, see
+                _compute_risk_coalitions
+
+        Returns:
+            "bullet" if a member of the coalition does bullet voting,
+            "permutation" otherwise
+        """
+        if any(-1 in ballot for ballot in tactical_voting[0]):
+            return "bullet"
+        return "permutation"
+
+    def _iter_results(
+        self,
+        multi: MultiSchemeTally,
+        analyses: List[Tuple[int, Callable, Happiness, bool]],
+        verbose: Optional[bool] = True,
+        pool: Optional[multiprocessing.pool.Pool] = None,
+        count_only: Optional[bool] = False,
+    ) -> Iterator[Tuple[slice, List[Union[List[Tuple], int]]]]:
+        """
+        Find the tactical votings of each coalition under many schemes and
+        happiness functions.
+
+        In a situation stored as a histogram the voters with the same
+        preference are consecutive: each preference is analysed once, and
+        serially since there are at most m! of them, and its result is shared
+        by all its voters.
+
+        Args:
+            multi (MultiSchemeTally): honest outcomes of the schemes
+            analyses (List[Tuple[int, Callable, Happiness, bool]]): index of
+                the scheme in multi, happiness function, honest happiness and
+                whether bullet voting is allowed, for each analysis
+            verbose (bool): print the progress of the pool
+            pool (Optional - Pool): pool from _worker_pool
+            count_only (bool): only count the tactical votings
+        Yields:
+            The range of indices of the coalitions and, for each analysis,
+            their tactical votings (or their amount), in order
+        """
+        counts = self.situation.counts
+        if counts is None:
+            for n, result in enumerate(
+                self._iter_coalitions(multi, analyses, verbose, pool, count_only)
+            ):
+                yield slice(n, n + 1), result
+            return
+
+        preferences = [(preference,) for preference in range(len(counts))]
+        stop = 0
+        for count, result in zip(
+            counts.tolist(),
+            self._evaluate_coalitions(multi, analyses, preferences, count_only),
+        ):
+            start, stop = stop, stop + count
+            yield slice(start, stop), result
+
+    def _iter_coalitions(
+        self,
+        multi: MultiSchemeTally,
+        analyses: List[Tuple[int, Callable, Happiness, bool]],
+        verbose: Optional[bool] = True,
+        pool: Optional[multiprocessing.pool.Pool] = None,
+        count_only: Optional[bool] = False,
+    ) -> Iterator[List[Union[List[Tuple], int]]]:
+        """
+        Find the tactical votings of each coalition, serially or with a pool
+        of processes when workers are used.
+
+        Args:
+            multi (MultiSchemeTally): honest outcomes of the schemes
+            analyses (List[Tuple[int, Callable, Happiness, bool]]): see
+                _iter_results
+            verbose (bool): print the progress of the pool
+            pool (Optional - Pool): pool from _worker_pool
+            count_only (bool): only count the tactical votings
+        Yields:
+            For each coalition, in order, its tactical votings (or their
+            amount) in each analysis
+        """
+        if self._workers is None or self._workers <= 1:
+            yield from self._evaluate_coalitions(
+                multi,
+                analyses,
+                combinations(range(self.voters), self._coalition),
+                count_only,
+            )
+        elif pool is None:
+            with self._worker_pool() as pool:
+                yield from self._search_coalitions(
+                    pool, multi, analyses, verbose, count_only
+                )
+        else:
+            yield from self._search_coalitions(
+                pool, multi, analyses, verbose, count_only
+            )
+
+    @contextlib.contextmanager
+    def _worker_pool(self) -> Iterator[Optional[multiprocessing.pool.Pool]]:
+        """
+        Open the pool of processes for the coalition search, None if the
+        search is serial.
+
+        The voting matrix is published in shared memory: the workers attach
+        to it once and then only receive ranges of coalition indices.
+        The same pool can run the search of every scheme.
+        """
+        parallel = self._workers is not None and self._workers > 1
+        if not parallel or self.situation.counts is not None:
+            yield None
+            return
+
+        config = {
+            "advance_voters_coalition": self._coalition,
+            "allow_bullet_voting": "both" if len(self._variants) > 1 else self._bullet,
+            "happiness_cache_size": self.happiness_cache.max_size,
+        }
+        with self.situation.share() as shared:
+            with multiprocessing.Pool(
+                self._workers,
+                initializer=_init_worker,
+                initargs=(shared.descriptor, config),
+            ) as pool:
+                yield pool
+
+    def _search_coalitions(
+        self,
+        pool: multiprocessing.pool.Pool,
+        multi: MultiSchemeTally,
+        analyses: List[Tuple[int, Callable, Happiness, bool]],
+        verbose: Optional[bool] = True,
+        count_only: Optional[bool] = False,
+    ) -> Iterator[List[Union[List[Tuple], int]]]:
+        """
+        Find the tactical votings of every coalition with a pool of processes
+
+        The coalitions are independent: they are split in chunks of indices
+        and the results are merged back in the original order. The workers
+        build the same analyses from the schemes, happiness functions and
+        bullet voting variants.
+
+        Args:
+            pool (Pool): pool from _worker_pool
+            multi (MultiSchemeTally): honest outcomes of the schemes
+            analyses (List[Tuple[int, Callable, Happiness, bool]]): see
+                _iter_results
+            verbose (bool): print the progress after each chunk
+            count_only (bool): only count the tactical votings
+        Yields:
+            For each coalition, in order, its tactical votings (or their
+            amount) in each analysis
+        """
+        key = (
+            tuple(multi.voting_schemes),
+            tuple(dict.fromkeys(func for _, func, *_ in analyses)),
+            tuple(dict.fromkeys(bullet for *_, bullet in analyses)),
+        )
+        coalitions_am = math.comb(self.voters, self._coalition)
+        chunk_size = math.ceil(coalitions_am / (4 * self._workers))
+        chunks = [
+            key + (start, min(start + chunk_size, coalitions_am), count_only)
+            for start in range(0, coalitions_am, chunk_size)
+        ]
+
+        for done, chunk_result in enumerate(pool.imap(_evaluate_chunk, chunks), 1):
+            yield from chunk_result
+            if verbose:
+                print(f"Chunk {done}/{len(chunks)} of coalitions done")
+
+    def _evaluate_coalitions(
+        self,
+        multi: MultiSchemeTally,
+        analyses: List[Tuple[int, Callable, Happiness, bool]],
+        coalitions: Iterable[Tuple[int]],
+        count_only: Optional[bool] = False,
+    ) -> Iterator[List[Union[List[Tuple], int]]]:
+        """
+        Find the tactical votings of some coalitions
+
+        The tactical votings of a coalition only depend on the preferences of
+        its members: the coalitions with the same multiset of voter types are
+        searched once, with the members sorted by type, and the votings found
+        are reordered for each coalition. The new overall happiness is still
+        computed for each coalition.
+
+        The coalitions are read one at the time and only the results of the
+        max_cached_groups multisets used most recently are kept, so the
+        memory does not grow with the number of coalitions.
+
+        When both bullet voting variants are analysed, each tactical voting
+        has its family (see _get_family) as an extra field.
+
+        Args:
+            multi (MultiSchemeTally): honest outcomes of the schemes
+            analyses (List[Tuple[int, Callable, Happiness, bool]]): see
+                _iter_results
+            coalitions (Iterable[Tuple[int]]): voters of each coalition
+            count_only (bool): only count the tactical votings
+        Yields:
+            For each coalition, in order, its tactical votings (or their
+            amount) in each analysis
+        """
+        types = self._voter_types.tolist()
+        tag = len(self._variants) > 1
+
+        # key: multiset of types, values: tactical votings of each analysis,
+        # the least recently used group is dropped when the cache is full
+        groups: "OrderedDict[Tuple[int], List]" = OrderedDict()
+        for c in coalitions:
+            # members of the coalition sorted by type
+            order = sorted(range(len(c)), key=lambda j: types[c[j]])
+            key = tuple(types[c[j]] for j in order)
+            if key in groups:
+                groups.move_to_end(key)
+            else:
+                sorted_c = tuple(c[j] for j in order)
+                groups[key] = self._find_tactical_votings(
+                    multi, analyses, sorted_c, count_only
+                )
+                if len(groups) > self.max_cached_groups:
+                    groups.popitem(last=False)
+            group = groups[key]
+
+            if count_only:
+                yield group
+                continue
+
+            # key: (scheme, happiness function), values: tactical votings
+            # with bullet voting, the ones without are a subset of them
+            evaluated = {}
+            results = []
+            for (s, func, happiness, bullet), found in zip(analyses, group):
+                if not bullet and (s, func) in evaluated:
+                    results.append(
+                        [
+                            tv
+                            for tv in evaluated[(s, func)]
+                            if self._get_family(tv) == "permutation"
+                        ]
+                    )
+                    continue
+                result = self._evaluate_coalition(
+                    multi.tallies[s],
+                    happiness,
+                    c,
+                    self._reorder_members(found, order),
+                    func,
+                )
+                if tag:
+                    result = [tv + (self._get_family(tv),) for tv in result]
+                if bullet:
+                    evaluated[(s, func)] = result
+                results.append(result)
+            yield results
+
+    def _reorder_members(
+        self, tactical_votings: Tuple[np.array, ...], order: List[int]
+    ) -> Tuple[np.array, ...]:
+        """
+        Args:
+            tactical_votings (Tuple[np.array, ...]): tactical votings of the
+                coalition with the members sorted by type, see
+                _find_tactical_votings
+            order (List[int]): position in the coalition of each member of
+                the sorted coalition
+
+        Returns:
+            The tactical votings with the members in the order of the
+            coalition, sorted by their index in its enumeration
+        """
+        if order == sorted(order):
+            return tactical_votings
+
+        indices, tv_ballots, new_outcomes, new_coalition_happiness = tactical_votings
+        position = np.argsort(order)
+        shape = (self._member_votings,) * len(order)
+        members = np.unravel_index(indices, shape)
+        indices = np.ravel_multi_index(tuple(members[p] for p in position), shape)
+
+        ordered = np.argsort(indices)
+        return (
+            indices[ordered],
+            tv_ballots[ordered][:, position],
+            new_outcomes[ordered],
+            new_coalition_happiness[ordered][:, position],
+        )
+
+    def _evaluate_coalition(
+        self,
+        tally: IncrementalTally,
+        original_happiness: Happiness,
+        c: Tuple[int],
+        tactical_votings: Tuple[np.array, ...],
+        happiness_func: Callable = Happiness.get_voter_happiness,
+    ) -> List[Tuple]:
+        """
+        Build the records of the tactical votings of one coalition
+
+        Args:
+            tally (IncrementalTally): honest outcome of the scheme
+            original_happiness (Happiness): honest happiness
+            c (Tuple[int]): voters of the coalition
+            tactical_votings (Tuple[np.array, ...]): tactical votings of the
+                coalition, see _search_coalition
+            happiness_func (Callable): happiness function of the voters, used
+                for the new overall happiness
+        Returns:
+            List of the tactical votings of the coalition, see
+            _compute_risk_coalitions.
+        """
+        _, tv_ballots, new_outcomes, new_coalition_happiness = tactical_votings
+
+        # the happiness of the voters that keep their ballot comes from the
+        # cache, the members are evaluated with their new ballot
+        members_happiness = Happiness.evaluate(
+            tv_ballots, new_outcomes[:, None, :], happiness_func
+        )
+        counts = self.situation.counts
+        if counts is not None:
+            # voters left with their preference, the coalition is added apart
+            remaining = counts.copy()
+            np.subtract.at(remaining, list(c), 1)
+            weights = np.concatenate((remaining, np.ones(len(c), dtype=np.int64)))
+        result = []
+        for b in range(len(tv_ballots)):
+            honest = self.happiness_cache.get(new_outcomes[b], happiness_func)
+            if counts is None:
+                new_happiness = honest.copy()
+                new_happiness[list(c)] = members_happiness[b]
+            else:
+                new_happiness = weights * np.concatenate(
+                    (honest, members_happiness[b])
+                )
+            result.append(
+                (
+                    # small Python ints are shared, numpy scalars are not
+                    tuple(map(tuple, tv_ballots[b].tolist())),
+                    tuple(new_outcomes[b]),
+                    new_coalition_happiness[b],
+                    original_happiness.individual_happiness[list(c)],
+                    np.sum(new_happiness),
+                    original_happiness.happiness,
+                )
+            )
+        return result
+
+    def _find_tactical_votings(
+        self,
+        multi: MultiSchemeTally,
+        analyses: List[Tuple[int, Callable, Happiness, bool]],
+        c: Tuple[int],
+        count_only: Optional[bool] = False,
+    ) -> List[Union[Tuple[np.array, ...], int]]:
+        """
+        Args:
+            multi (MultiSchemeTally): honest outcomes of the schemes
+            analyses (List[Tuple[int, Callable, Happiness, bool]]): see
+                _iter_results
+            c (Tuple[int]): voters of the coalition
+            count_only (bool): only count the tactical votings
+        Returns:
+            For each analysis the tactical votings of the coalition (see
+            _search_coalition), or their amount
+        """
+        blocks = self._search_coalition(multi, analyses, c)
+        if count_only:
+            counts = [0] * len(analyses)
+            for block in blocks:
+                for a, found in enumerate(block):
+                    counts[a] += len(found[0])
+            return counts
+
+        blocks = list(blocks)
+        return [
+            tuple(np.concatenate(field) for field in zip(*analysis_blocks))
+            for analysis_blocks in zip(*blocks)
+        ]
+
+    def _search_coalition(
+        self,
+        multi: MultiSchemeTally,
+        analyses: List[Tuple[int, Callable, Happiness, bool]],
+        c: Tuple[int],
+    ) -> Iterator[List[Tuple[np.array, np.array, np.array, np.array]]]:
+        """
+        Evaluate the alternative votings of one coalition, block by block
+
+        The votings are generated lazily (see BallotEnumerator), so the
+        memory used does not depend on the number of votings. Each block is
+        generated once, the outcomes of every scheme are computed together
+        and each happiness function is evaluated once on all of them.
+
+        A single voter only evaluates the votings that some analysis can not
+        screen out (see _screen_tactical_votings), the other ones are not
+        tactical in any analysis.
+
+        Args:
+            multi (MultiSchemeTally): honest outcomes of the schemes
+            analyses (List[Tuple[int, Callable, Happiness, bool]]): see
+                _iter_results
+            c (Tuple[int]): voters of the coalition
+        Yields:
+            For each analysis, the tactical votings of the block:
+            indices: indices of the tactical votings of the block
+            tv_ballots: tactical votings, T x k x m
+            new_outcomes: outcome of each tactical voting, T x m
+            new_coalition_happiness: happiness of each member, T x k
+        """
+        enumerator = BallotEnumerator(self.situation.voting_matrix[:, c], self._bullet)
+
+        # votings that can be tactical, as indices of the cartesian product
+        screened = [
+            self._screen_tactical_votings(multi.tallies[s], c, func)
+            for s, func, *_ in analyses
+        ]
+        if any(examined is None for examined in screened):
+            blocks = enumerator.blocks(self.block_size)
+        else:
+            examined = np.unique(np.concatenate(screened))
+            blocks = [(examined, enumerator.ballots(examined))]
+
+        # S x 1 x m, honest outcome of every scheme without the coalition
+        without = multi.without(c)[:, None, :]
+        # votes of each class of votings of a single voter under every scheme
+        # (see _get_class_votes), the classes need the permutation table
+        class_votes = None
+        if len(c) == 1 and self.options <= MAX_TABLE_CANDIDATES:
+            class_votes = self._get_class_votes(multi, c[0])
+        # votes of each voting of each member under every scheme (S x V x m),
+        # shared by the votings of the coalition where the member casts it
+        member_votes = None
+        if len(c) > 1:
+            member_votes = [
+                scheme_votes(
+                    multi.scheme_matrix, enumerator.member_ballots(j), self.options
+                )
+                for j in range(len(c))
+            ]
+
+        for indices, tv_ballots in blocks:
+            # S x B x m, outcomes of every scheme updated from the honest ones
+            if class_votes is not None:
+                new_outcomes = without + np.stack(
+                    [votes[classes[indices]] for classes, votes in class_votes]
+                )
+            elif member_votes is None:
+                new_outcomes = without + scheme_votes(
+                    multi.scheme_matrix, tv_ballots.transpose(0, 2, 1), self.options
+                )
+            else:
+                new_outcomes = without + sum(
+                    votes[:, member]
+                    for votes, member in zip(
+                        member_votes, enumerator.member_indices(indices)
+                    )
+                )
+            # key: happiness function, values: S x B x k happiness of each
+            # member for each scheme and voting
+            evaluated = {}
+            # votings without bullet voting, when both are enumerated
+            permuted = None
+            if self._bullet and not all(bullet for *_, bullet in analyses):
+                permuted = np.all(
+                    np.array(enumerator.member_indices(indices))
+                    < enumerator.permutation_votings,
+                    axis=0,
+                )
+
+            found = []
+            for (s, func, happiness, bullet), examined in zip(analyses, screened):
+                if func not in evaluated:
+                    evaluated[func] = Happiness.evaluate(
+                        tv_ballots[None], new_outcomes[:, :, None, :], func
+                    )
+                new_coalition_happiness = evaluated[func][s]
 
                 # Tactical voting if happiness improvess for everybody
-                if (
-                    new_happiness.individual_happiness[list(c)]
-                    > original_happiness.individual_happiness[list(c)]
-                ).all():
-                    # print(risks[n], len(result[n]))
-                    result[n][risks[n]] = (
-                        tv,
-                        tuple(new_outcome),
-                        new_happiness.individual_happiness[list(c)],
-                        original_happiness.individual_happiness[list(c)],
-                        new_happiness.happiness,
-                        original_happiness.happiness,
+                tactical = (
+                    new_coalition_happiness > happiness.individual_happiness[list(c)]
+                ).all(axis=1)
+                if examined is not None:
+                    tactical &= np.isin(indices, examined)
+                if not bullet and permuted is not None:
+                    tactical &= permuted
+                tactical = np.flatnonzero(tactical)
+                found.append(
+                    (
+                        indices[tactical],
+                        tv_ballots[tactical],
+                        new_outcomes[s][tactical],
+                        new_coalition_happiness[tactical],
                     )
-                    risks[n] += 1
-        result = [[j for j in i if j is not None] for i in result]
-        return result, risks
+                )
+            yield found
+
+    def _screen_tactical_votings(
+        self,
+        tally: IncrementalTally,
+        voters: Tuple[int],
+        happiness_func: Callable = Happiness.get_voter_happiness,
+    ) -> np.array:
+        """
+        Select the votings that may increase the happiness of the voters.
+
+        For a single voter the happiness is linear in the outcome, and the
+        happiness of every permutation of the honest ballot is obtained from
+        the gain table with one matrix-vector product in exact integer
+        arithmetic. The permutations that make the voter less happy are
+        discarded. The ones that do not, and the bullet votings, are left to
+        be evaluated as usual. Coalitions, the happiness functions that are
+        not linear and the honest ballots with empty positions (-1, bullet
+        voting), whose permutations the gain table does not describe, are
+        not screened.
+
+        Args:
+            tally (IncrementalTally): honest outcome of the scheme
+            voters (Tuple[int]): voter or coalition that change the ballot
+            happiness_func (Callable): happiness function of the voter
+
+        Returns:
+            The indices of the votings to evaluate, in the enumeration order
+            (permutations of the honest preference, then bullet votings).
+            None if all the votings must be evaluated.
+        """
+        weight = Happiness.get_position_weight(happiness_func, self.options)
+        if len(voters) != 1 or weight is None:
+            return None
+        honest = self.situation.voting_matrix[:, voters[0]]
+        if np.any(honest == -1):
+            return None
+
+        perms, delta, weights = self._get_gain_table(
+            tally.voting_scheme, self.options, weight
+        )
+
+        # Work with the candidates sorted as in the honest ballot: the votes
+        # of the candidate in position j, and the position of the candidate
+        # whose share is used for the weight of position j (election_vector[v - 1])
+        position = np.argsort(honest)
+        share_position = position[(honest - 1) % self.options]
+        votes = tally.outcome.astype(np.int64)[honest]
+
+        # happiness of each permutation, times the total amount of votes
+        gain = weights @ votes[share_position] + np.sum(
+            weights * delta[:, share_position], axis=1
+        )
+        candidates = np.flatnonzero(gain[1:] >= gain[0])
+
+        bullets = np.arange(len(perms) - 1, self.alternative_votings)
+        return np.concatenate((candidates, bullets))
+
+    def _get_class_votes(
+        self, multi: MultiSchemeTally, voter: int
+    ) -> List[Tuple[np.array, np.array]]:
+        """
+        Group the votings of a single voter in classes that give the same
+        votes (see compute_ballot_classes): the votes of a class are computed
+        once and shared by all its votings. Each bullet voting is a class.
+
+        Args:
+            multi (MultiSchemeTally): honest outcomes of the schemes
+            voter (int): voter that changes the ballot
+
+        Returns:
+            For each scheme, the class of each voting of the voter in the
+            enumeration order and the votes of each class
+        """
+        honest = self.situation.voting_matrix[:, voter]
+        class_votes = []
+        for tally in multi.tallies:
+            representatives, classes, _ = compute_ballot_classes(
+                tally.voting_scheme, self.options
+            )
+            # class of each voting, without the honest ballot
+            member_classes = classes[1:]
+            class_ballots = honest[representatives]
+            if self._bullet:
+                member_classes = np.concatenate(
+                    (member_classes, len(representatives) + np.arange(self.options))
+                )
+                class_ballots = np.concatenate(
+                    (class_ballots, self._get_bullet_votings())
+                )
+            class_votes.append(
+                (
+                    member_classes,
+                    ballot_votes(tally.scheme_vector, class_ballots, self.options),
+                )
+            )
+        return class_votes
+
+    @classmethod
+    def _get_gain_table(
+        cls, scheme_type: VotingScheme, candidates: int, weight: np.array
+    ) -> Tuple[np.array, np.array, np.array]:
+        """
+        Precompute the effect of each permutation of a ballot.
+
+        Positions refer to the honest ballot: permutation p moves the
+        candidate in position perms[p, i] to position i.
+
+        Args:
+            scheme_type (VotingScheme): scheme used to compute the outcome.
+            candidates (int): number of candidates.
+            weight (np.array): happiness weight of each position.
+
+        Returns:
+            perms (m! x m): permutations of the positions, the first one
+            is the honest ballot.
+            delta (m! x m): change of the votes of the candidate in each
+            honest position.
+            weights (m! x m): happiness weight of the candidate in each
+            honest position.
+        """
+        key = (scheme_type, candidates, tuple(weight))
+        if key not in cls._gain_tables:
+            perms = get_permutation_table(candidates)
+            rows = np.arange(len(perms))[:, None]
+            scheme_vector = compute_vot_scheme(scheme_type, candidates).astype(np.int64)
+
+            delta = np.zeros(perms.shape, dtype=np.int64)
+            delta[rows, perms] = scheme_vector
+            delta -= scheme_vector
+
+            weights = np.zeros(perms.shape, dtype=np.int64)
+            weights[rows, perms] = weight
+            cls._gain_tables[key] = (perms, delta, weights)
+
+        return cls._gain_tables[key]
 
     def _get_bullet_votings(self) -> np.array:
         """
         Returns:
             array of possible bullet voting
         """
-        # for each option i create (i, -1, -1, ...)
-        bullets = [None for i in range(self.options)]
-        for i in range(self.options):
-            p = [-1 for i in range(self.options)]
-            p[0] = i
-            bullets[i] = tuple(p)
-        return bullets
+        # for each option i (i, -1, -1, ...), shared by all the voters
+        return get_bullet_votings(self.options)
+
+
+class RiskCounter:
+    """
+    Counters of the tactical votings found for each coalition, see
+    TacticalVotingRisk.iter_tactical_votes
+    """
+
+    def __init__(self, coalitions_am: int, alternative_votings: int) -> None:
+        """
+        Args:
+            coalitions_am (int): number of coalitions (or voters)
+            alternative_votings (int): number of alternative votings of
+                each coalition
+        """
+        self.risks = np.zeros(coalitions_am, dtype=np.int64)
+        self.alternative_votings = alternative_votings
+
+    def add(self, coalition: Union[int, slice], tactical_votings: int = 1) -> None:
+        """
+        Args:
+            coalition (int or slice): index of the coalition, or range of
+                coalitions that have the same tactical votings
+            tactical_votings (int): number of tactical votings found for
+                each coalition
+        """
+        self.risks[coalition] += tactical_votings
+
+    @property
+    def avg_risk(self) -> float:
+        """
+        Returns:
+            Fraction of the alternative votings that are tactical
+        """
+        return np.sum(self.risks) / (self.alternative_votings * len(self.risks))
+
+    @property
+    def avg_bool_risk(self) -> float:
+        """
+        Returns:
+            Fraction of the coalitions that have at least one tactical voting
+        """
+        return np.sum(self.risks > 0) / len(self.risks)
+
+
+class RiskEstimate(float):
+    """
+    Risk estimated by sampling: the point estimate, tagged with the Wilson
+    score confidence interval. It can be used as the float of the risk.
+    """
+
+    estimated = True
+
+    def __new__(
+        cls, tactical: int, samples: int, confidence: float = 0.95
+    ) -> "RiskEstimate":
+        """
+        Args:
+            tactical (int): number of tactical samples
+            samples (int): number of samples
+            confidence (float): confidence level of the interval
+        """
+        estimate = super().__new__(cls, tactical / samples if samples else math.nan)
+        estimate.tactical = tactical
+        estimate.samples = samples
+        estimate.confidence = confidence
+        estimate.interval = wilson_interval(tactical, samples, confidence)
+        return estimate
+
+    @property
+    def width(self) -> float:
+        """
+        Returns:
+            Width of the confidence interval
+        """
+        return self.interval[1] - self.interval[0]
+
+    def __repr__(self) -> str:
+        low, high = self.interval
+        return f"{float(self)} ({self.confidence:.0%} CI {low:.4f}-{high:.4f})"
+
+
+def wilson_interval(
+    successes: int, trials: int, confidence: float = 0.95
+) -> Tuple[float, float]:
+    """
+    Wilson score interval of a proportion
+
+    Args:
+        successes (int): number of successes
+        trials (int): number of trials
+        confidence (float): confidence level
+
+    Returns:
+        Lower and upper bound of the interval, (0, 1) without trials
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / trials
+    denominator = 1 + z**2 / trials
+    center = (p + z**2 / (2 * trials)) / denominator
+    half = z / denominator * math.sqrt(p * (1 - p) / trials + z**2 / (4 * trials**2))
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def unrank_combination(n: int, k: int, rank: int) -> List[int]:
+    """
+    Args:
+        n (int): number of elements
+        k (int): size of the combinations
+        rank (int): index of the combination, in the order of
+            itertools.combinations(range(n), k)
+
+    Returns:
+        The combination with that index, in increasing order
+    """
+    combination = []
+    element = 0
+    for size in range(k, 0, -1):
+        # skip the combinations whose next element is smaller
+        while math.comb(n - element - 1, size - 1) <= rank:
+            rank -= math.comb(n - element - 1, size - 1)
+            element += 1
+        combination.append(element)
+        element += 1
+    return combination
+
+
+def iter_combinations(n: int, k: int, start: int, stop: int) -> Iterator[Tuple[int]]:
+    """
+    Generate a range of the combinations of itertools.combinations(range(n),
+    k) without the previous ones: the first is unranked and the others
+    follow in lexicographic order.
+
+    Args:
+        n (int): number of elements
+        k (int): size of the combinations
+        start (int): index of the first combination
+        stop (int): index after the last combination
+
+    Yields:
+        The combinations, as tuples
+    """
+    combination = unrank_combination(n, k, start) if start < stop else []
+    for _ in range(start, stop):
+        yield tuple(combination)
+        # move the last element that is not at its largest value, the
+        # following ones come right after it
+        i = k - 1
+        while i >= 0 and combination[i] == n - k + i:
+            i -= 1
+        if i < 0:
+            return
+        combination[i] += 1
+        for j in range(i + 1, k):
+            combination[j] = combination[j - 1] + 1
+
+
+# State of a worker process of the coalition search
+_worker_state = {}
+
+
+def _init_worker(descriptor: Tuple, config: Dict[str, Any]) -> None:
+    """
+    Initialize a worker process of the coalition search
+
+    Args:
+        descriptor (Tuple): descriptor of the shared voting matrix
+        config (Dict[str, Any]): arguments of the TacticalVotingRisk
+    """
+    # keep the shared memory mapped as long as the worker lives
+    shared = SharedVotingMatrix(descriptor=descriptor).open()
+    tva = TacticalVotingRisk(situation=shared.situation, **config)
+    _worker_state["shared"] = shared
+    _worker_state["tva"] = tva
+    # key: (schemes, happiness functions, variants), values: analyses
+    _worker_state["analyses"] = {}
+
+
+def _evaluate_chunk(
+    chunk: Tuple[Tuple, Tuple, Tuple, int, int, bool],
+) -> List[List[Union[List[Tuple], int]]]:
+    """
+    Find the tactical votings of a chunk of coalitions in a worker process
+
+    Args:
+        chunk (Tuple[Tuple, Tuple, Tuple, int, int, bool]): schemes,
+            happiness functions and bullet voting variants of the analyses,
+            range of indices of the coalitions and whether to only count the
+            tactical votings
+
+    Returns:
+        For each coalition its tactical votings (or their amount) in each
+        analysis
+    """
+    *key, start, stop, count_only = chunk
+    key = tuple(key)
+    tva = _worker_state["tva"]
+    analyses = _worker_state["analyses"]
+    if key not in analyses:
+        schemes, functions, variants = key
+        analyses[key] = tva._get_analyses(
+            list(schemes), False, list(functions), list(variants)
+        )
+    multi, chunk_analyses = analyses[key]
+
+    return list(
+        tva._evaluate_coalitions(
+            multi,
+            chunk_analyses,
+            iter_combinations(tva.voters, tva._coalition, start, stop),
+            count_only,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -4,11 +4,16 @@ This module defines the voting schemes.
 It contains:
     * VotingScheme: the enumerator used to identify the different schemes
     * compute_vot_scheme: a function that generate the voting vector
+    * compute_scheme_runs: a function that find the interchangeable positions
+    * compute_ballot_classes: a function that group the ballots with the same votes
 """
 
 import enum
+from typing import Dict, List, Tuple
 import numpy as np
 
+from BallotEnumeration import get_permutation_table
+
 
 class VotingScheme(enum.Enum):
     """
@@ -53,3 +58,70 @@ def compute_vot_scheme(scheme: VotingScheme, candidate_am: int) -> np.array:
         for i in range(1, candidate_am):
             vot_scheme[i - 1] = candidate_am - i
     return vot_scheme
+
+
+def compute_scheme_runs(
+    scheme: VotingScheme, candidate_am: int
+) -> List[Tuple[int, int]]:
+    """
+    Function to find the positions that receive the same amount of votes
+
+    Args:
+        scheme (VotingScheme): the scheme needed.
+        candidate_am (int): number of candidates.
+
+    Returns:
+        List of the (start, end) ranges of consecutive positions with the
+        same votes, they cover all the positions in order.
+    """
+    vot_scheme = compute_vot_scheme(scheme, candidate_am)
+    runs = []
+    start = 0
+    for end in range(1, candidate_am + 1):
+        if end == candidate_am or vot_scheme[end] != vot_scheme[start]:
+            runs.append((start, end))
+            start = end
+    return runs
+
+
+# key: (scheme, candidate_am), values: (representatives, classes, counts)
+_ballot_classes: Dict[Tuple, Tuple[np.array, np.array, np.array]] = {}
+
+
+def compute_ballot_classes(
+    scheme: VotingScheme, candidate_am: int
+) -> Tuple[np.array, np.array, np.array]:
+    """
+    Function to group the ballots that give the same votes to every candidate
+
+    Positions that receive the same amount of votes are interchangeable, so
+    for VOTE_FOR_ONE only the first choice matters, for VOTE_FOR_TWO only the
+    unordered top pair and for VETO only the last choice.
+    The ballots are the permutations of the positions of a reference ballot,
+    in the order of the permutation table (get_permutation_table).
+
+    Args:
+        scheme (VotingScheme): the scheme needed.
+        candidate_am (int): number of candidates.
+
+    Returns:
+        representatives: one permutation for each class, with the positions
+            sorted inside each group of interchangeable positions.
+        classes: class of each of the candidate_am! permutations.
+        counts: number of permutations in each class (multiplicity).
+    """
+    key = (scheme, candidate_am)
+    if key not in _ballot_classes:
+        perms = get_permutation_table(candidate_am)
+
+        # Sort the positions inside each run of equal votes
+        canonical = perms.copy()
+        for start, end in compute_scheme_runs(scheme, candidate_am):
+            canonical[:, start:end] = np.sort(perms[:, start:end], axis=1)
+
+        representatives, classes, counts = np.unique(
+            canonical, axis=0, return_inverse=True, return_counts=True
+        )
+        _ballot_classes[key] = (representatives, classes.reshape(-1), counts)
+
+    return _ballot_classes[key]
@@ -3,14 +3,100 @@ This module defines the voting situation
 
 It contains:
     * VotingSituation: class representing the voting situation
+    * IncrementalTally: outcome of a situation updated ballot by ballot
+    * MultiSchemeTally: outcomes of a situation under many schemes at once
+    * SharedVotingMatrix: voting matrix published in shared memory
+    * ballot_votes: function that compute the votes given by stacks of ballots
+    * scheme_votes: function that compute the votes of stacks of ballots
+      under many schemes
+    * ballot_dtype: function that give the smallest type for the ballots
+    * reference_tally: function that compute the outcome cell by cell
+    * cross_check: function that compare the tallies with reference_tally
 """
 
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Sequence, Tuple, Union
 import numpy as np
 
 from Vot_Scheme import VotingScheme, compute_vot_scheme
 from Happiness import Happiness
 
 
+def ballot_dtype(candidate_am: int) -> np.dtype:
+    """
+    Args:
+        candidate_am: number of candidates
+
+    Returns:
+        The smallest signed integer type that holds the candidates and the
+        -1 of the bullet votings
+    """
+    # -candidate_am fits the type exactly when candidate_am - 1 does
+    return np.min_scalar_type(-candidate_am)
+
+
+def ballot_votes(
+    scheme_vector: np.array, ballots: np.array, candidate_am: int
+) -> np.array:
+    """
+    Compute the votes given by each ballot in a stack.
+
+    Args:
+        scheme_vector: votes given to each preference position
+        ballots: stack of ballots with shape B x m x k (k ballots per entry,
+            one per column). A B x m stack of single ballots is also accepted.
+        candidate_am: number of candidates
+
+    Returns:
+        voting_vectors: B x m array, row b contains the votes given by the
+        ballots of the b-th entry, sorted by candidate.
+
+    """
+    ballots = np.asarray(ballots)
+    if ballots.ndim == 2:
+        ballots = ballots[:, :, None]
+    batch = ballots.shape[0]
+
+    weights = np.broadcast_to(scheme_vector[None, :, None], ballots.shape)
+    voted = ballots != -1  # No vote
+    # Shift the candidates of entry b to the bins of row b
+    bins = ballots + candidate_am * np.arange(batch)[:, None, None]
+    return np.bincount(
+        bins[voted], weights=weights[voted], minlength=batch * candidate_am
+    ).reshape((batch, candidate_am))
+
+
+def scheme_votes(
+    scheme_matrix: np.array, ballots: np.array, candidate_am: int
+) -> np.array:
+    """
+    Compute the votes given by each ballot in a stack under many schemes.
+
+    The ballots are counted as the times each candidate is in each position,
+    then all the schemes are applied with a single product.
+
+    Args:
+        scheme_matrix: S x m array, row s contains the votes given to each
+            preference position by the s-th scheme
+        ballots: stack of ballots with shape B x m x k, as in ballot_votes.
+            A B x m stack of single ballots is also accepted.
+        candidate_am: number of candidates
+
+    Returns:
+        voting_vectors: S x B x m array, entry (s, b) contains the votes
+        given by the ballots of the b-th entry under the s-th scheme.
+    """
+    ballots = np.asarray(ballots)
+    if ballots.ndim == 2:
+        ballots = ballots[:, :, None]
+
+    # B x positions x candidates, -1 (no vote) matches no candidate
+    placed = np.sum(
+        ballots[..., None] == np.arange(candidate_am, dtype=ballots.dtype), axis=2
+    )
+    return np.einsum("sp,bpc->sbc", scheme_matrix, placed)
+
+
 class VotingSituation:
     """
     This class simulate a voting as matrix containg the preference of the voters.
@@ -21,6 +107,10 @@ class VotingSituation:
     preference.
 
     The values in the matrix identify the different candidates.
+
+    A situation can also be stored as a histogram (see from_histogram): each
+    column is a distinct preference and counts gives the number of voters
+    that have it. counts is None when each column is a single voter.
     """
 
     def __init__(self, voter_am: int, candidate_am: int) -> None:
@@ -29,25 +119,162 @@ class VotingSituation:
             voter_am: number of voters
             candidate_am: number of candidates
         """
-        voting_vector = np.arange(0, candidate_am)
+        voting_vector = np.arange(0, candidate_am, dtype=ballot_dtype(candidate_am))
 
         self.candidate_am = candidate_am
         self.voting_matrix = np.repeat(voting_vector, repeats=voter_am).reshape(
             (candidate_am, voter_am)
         )
+        self.counts = None
         self.shufflevote()
 
-    def shufflevote(self) -> None:
+    @classmethod
+    def random(
+        cls,
+        voter_am: int,
+        candidate_am: int,
+        seed: Union[None, int, np.random.Generator] = None,
+    ) -> "VotingSituation":
+        """
+        Create a random situation, like the constructor, with a numpy Generator
+
+        The preferences of all the voters are shuffled at once and stored
+        with the smallest integer type (see ballot_dtype), so large
+        electorates are cheap to create. The global numpy state is not used:
+        a seed, or a Generator of each worker, makes the situation
+        reproducible.
+
+        Args:
+            voter_am: number of voters
+            candidate_am: number of candidates
+            seed: seed or Generator, by default fresh entropy
+
+        Returns:
+            situation: the voting situation
+        """
+        rng = np.random.default_rng(seed)
+        preferences = np.tile(
+            np.arange(candidate_am, dtype=ballot_dtype(candidate_am)), (voter_am, 1)
+        )
+        rng.permuted(preferences, axis=1, out=preferences)
+        # one voter for each column
+        return cls.from_matrix(preferences.T)
+
+    @classmethod
+    def from_matrix(cls, voting_matrix: np.array) -> "VotingSituation":
+        """
+        Create the situation of a given preference matrix
+
+        Args:
+            voting_matrix: preference matrix, one column for each voter
+
+        Returns:
+            situation: the voting situation, it uses voting_matrix without
+            copying it.
+        """
+        situation = cls.__new__(cls)
+        situation.candidate_am = voting_matrix.shape[0]
+        situation.voting_matrix = voting_matrix
+        situation.counts = None
+        return situation
+
+    @classmethod
+    def from_histogram(
+        cls, ballots: np.array, counts: Sequence[int]
+    ) -> "VotingSituation":
+        """
+        Create an anonymous situation from its distinct preferences
+
+        The outcome and the happiness do not depend on the order of the
+        voters, so the situation can be stored as each distinct preference
+        with the number of voters that have it: the cost of the tallies and
+        of the happiness depends on the number of distinct preferences (at
+        most m!) and not on the number of voters.
+
+        The voters are numbered preference by preference: the first counts[0]
+        voters have the preference ballots[:, 0], the next counts[1] voters
+        ballots[:, 1] and so on.
+
+        Args:
+            ballots: distinct preferences, one column each (m x T)
+            counts: number of voters of each preference
+
+        Returns:
+            situation: the voting situation, its voting matrix contains the
+            preferences that have at least one voter.
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        if counts.shape != (ballots.shape[1],):
+            raise ValueError("There must be one count for each preference")
+
+        cast = counts > 0
+        situation = cls.from_matrix(ballots[:, cast])
+        situation.counts = counts[cast]
+        return situation
+
+    @property
+    def voter_am(self) -> int:
+        """
+        Returns:
+            Number of voters of the situation
+        """
+        if self.counts is None:
+            return self.voting_matrix.shape[1]
+        return int(np.sum(self.counts))
+
+    def histogram(self) -> Tuple[np.array, np.array]:
+        """
+        Returns:
+            The distinct preferences, one column each, and the number of
+            voters that have each of them.
+        """
+        if self.counts is not None:
+            return self.voting_matrix, self.counts
+        return np.unique(self.voting_matrix, axis=1, return_counts=True)
+
+    def expand(self) -> "VotingSituation":
+        """
+        Returns:
+            situation: the same situation with one column for each voter,
+            itself if it is not stored as a histogram.
+        """
+        if self.counts is None:
+            return self
+        return VotingSituation.from_matrix(
+            np.repeat(self.voting_matrix, self.counts, axis=1)
+        )
+
+    def share(self) -> "SharedVotingMatrix":
+        """
+        Publish the preference matrix in shared memory, see SharedVotingMatrix
+
+        Returns:
+            shared: context manager that owns the shared memory
+        """
+        return SharedVotingMatrix(situation=self)
+
+    def shufflevote(self, rng: Optional[np.random.Generator] = None) -> None:
         """
         Shuffle the preference matrix to generate a new situation
+
+        Args:
+            rng: Generator used to shuffle all the voters at once, by default
+                each voter is shuffled with the global numpy state
+
         Returns:
             None: DESCRIPTION.
 
         """
+        if rng is not None:
+            rng.permuted(self.voting_matrix, axis=0, out=self.voting_matrix)
+            return
         np.array([np.random.shuffle(x) for x in self.voting_matrix.T])
 
     def calculate_vote_given_matrix(
-        self, voting_scheme: VotingScheme, voting_matrix: np.array
+        self,
+        voting_scheme: VotingScheme,
+        voting_matrix: np.array,
+        counts: Optional[np.array] = None,
     ) -> np.array:
         """
         Compute the outcome of the votation
@@ -55,6 +282,7 @@ class VotingSituation:
         Args:
             voting_scheme: scheme used to assign votes
             voting_matrix: voting situation
+            counts: number of voters of each column, one by default
 
         Returns:
             voting_vector: number of votes for the each candidate.
@@ -63,14 +291,53 @@ class VotingSituation:
 
         """
         scheme_vector = compute_vot_scheme(voting_scheme, voting_matrix.shape[0])
-        voting_vector = np.zeros(self.candidate_am)
-        for i in range(self.candidate_am):  # for each candidate / row in matrix
-            for vote in voting_matrix[i]:
-                if vote != -1:  # No vote
-                    voting_vector[vote] += scheme_vector[i]
+        # Each cell gives the weight of its row (position) to its candidate
+        weights = np.broadcast_to(scheme_vector[:, None], voting_matrix.shape)
+        if counts is not None:
+            weights = weights * counts
+        voted = voting_matrix != -1  # No vote
+        voting_vector = np.bincount(
+            voting_matrix[voted], weights=weights[voted], minlength=self.candidate_am
+        )
 
         return voting_vector
 
+    def calculate_votes_given_ballots(
+        self,
+        voting_scheme: VotingScheme,
+        voting_matrix: np.array,
+        voters: Union[int, Sequence[int]],
+        ballots: np.array,
+    ) -> np.array:
+        """
+        Compute the outcomes of many votations that differ from voting_matrix
+        only in the ballots of some voters.
+
+        The voters not listed are tallied once, then the contribution of
+        each replacement ballot is added in a single bincount.
+
+        Args:
+            voting_scheme: scheme used to assign votes
+            voting_matrix: base voting situation
+            voters: index of the voter (or indices of the coalition) whose
+                ballots are replaced
+            ballots: stack of replacement ballots with shape B x m x k, where
+                m is the number of candidates and k the number of voters.
+                For a single voter a B x m stack is also accepted.
+
+        Returns:
+            voting_vectors: B x m array, row b is the outcome obtained with
+            the b-th replacement ballot.
+
+        """
+        # Outcome of all the voters that keep their ballot
+        base_vector = self.calculate_vote_given_matrix(
+            voting_scheme, np.delete(voting_matrix, voters, axis=1)
+        )
+        scheme_vector = compute_vot_scheme(voting_scheme, voting_matrix.shape[0])
+
+        return base_vector + ballot_votes(scheme_vector, ballots, self.candidate_am)
+
     def calculatevote(self, voting_scheme):
         """
         Compute the outcome of this voting situation
@@ -84,10 +351,306 @@ class VotingSituation:
             [votes candidate 1, votes candidate 2, ..., votes candidate n]
 
         """
-        return self.calculate_vote_given_matrix(voting_scheme, self.voting_matrix)
+        return self.calculate_vote_given_matrix(
+            voting_scheme, self.voting_matrix, self.counts
+        )
+
+
+class IncrementalTally:
+    """
+    Outcome of a voting situation under one scheme, kept up to date when
+    some voters replace their ballots.
+
+    The honest outcome is computed once. The outcome of a trial is obtained
+    by removing the votes of the honest ballots of the voters that change
+    and adding the votes of their new ballots, so each trial costs O(m * k)
+    instead of a full tally of the matrix.
+
+    The voters are the columns of the voting matrix: in a histogram situation
+    a column is a distinct preference and one of its voters is replaced.
+    """
+
+    def __init__(self, situation: VotingSituation, voting_scheme: VotingScheme) -> None:
+        """
+        Args:
+            situation: voting situation with the honest ballots
+            voting_scheme: scheme used to assign votes
+        """
+        self.voting_scheme = voting_scheme
+        self.candidate_am = situation.candidate_am
+        self.voting_matrix = situation.voting_matrix
+        self.scheme_vector = compute_vot_scheme(
+            voting_scheme, self.voting_matrix.shape[0]
+        )
+        self.outcome = situation.calculatevote(voting_scheme)
+
+    def without(self, voters: Union[int, Sequence[int]]) -> np.array:
+        """
+        Args:
+            voters: index of the voter or indices of the coalition
+
+        Returns:
+            voting_vector: honest outcome without the votes of the voters.
+        """
+        honest_ballots = self.voting_matrix[:, np.atleast_1d(voters)]
+        honest_votes = ballot_votes(
+            self.scheme_vector, honest_ballots[None], self.candidate_am
+        )
+        return self.outcome - honest_votes[0]
+
+    def outcomes(
+        self, voters: Union[int, Sequence[int]], ballots: np.array
+    ) -> np.array:
+        """
+        Args:
+            voters: index of the voter or indices of the coalition
+            ballots: stack of replacement ballots with shape B x m x k
+                (B x m for a single voter)
+
+        Returns:
+            voting_vectors: B x m array, row b is the outcome obtained with
+            the b-th replacement ballot.
+        """
+        return self.without(voters) + ballot_votes(
+            self.scheme_vector, ballots, self.candidate_am
+        )
+
+
+class MultiSchemeTally:
+    """
+    Outcomes of a voting situation under many schemes, kept up to date when
+    some voters replace their ballots.
+
+    It holds an IncrementalTally for each scheme. The outcomes of a trial
+    under every scheme are obtained together: the vote vectors of the
+    schemes are stacked in an S x m matrix and the replacement ballots are
+    counted once for all of them (see scheme_votes).
+    """
+
+    def __init__(
+        self, situation: VotingSituation, voting_schemes: Sequence[VotingScheme]
+    ) -> None:
+        """
+        Args:
+            situation: voting situation with the honest ballots
+            voting_schemes: schemes used to assign votes
+        """
+        self.voting_schemes = list(voting_schemes)
+        self.candidate_am = situation.candidate_am
+        self.tallies = [
+            IncrementalTally(situation, scheme) for scheme in self.voting_schemes
+        ]
+        self.scheme_matrix = np.array([tally.scheme_vector for tally in self.tallies])
+
+    def without(self, voters: Union[int, Sequence[int]]) -> np.array:
+        """
+        Args:
+            voters: index of the voter or indices of the coalition
+
+        Returns:
+            voting_vectors: S x m array, honest outcome of each scheme
+            without the votes of the voters.
+        """
+        return np.array([tally.without(voters) for tally in self.tallies])
+
+    def outcomes(
+        self, voters: Union[int, Sequence[int]], ballots: np.array
+    ) -> np.array:
+        """
+        Args:
+            voters: index of the voter or indices of the coalition
+            ballots: stack of replacement ballots with shape B x m x k
+                (B x m for a single voter)
+
+        Returns:
+            voting_vectors: S x B x m array, entry (s, b) is the outcome of
+            the s-th scheme obtained with the b-th replacement ballot.
+        """
+        return self.without(voters)[:, None, :] + scheme_votes(
+            self.scheme_matrix, ballots, self.candidate_am
+        )
+
+
+class SharedVotingMatrix:
+    """
+    Preference matrix of a voting situation published in shared memory, so
+    that worker processes can read it without receiving a copy.
+
+    It is used as a context manager. The process that shares the situation
+    copies the matrix in a new block on enter and unlinks the block on exit.
+    The workers attach to the block with the descriptor and get a situation
+    whose matrix is a zero-copy view of the block. They only close their
+    mapping on exit. Several workers, and several analyses, can be attached
+    to the same block at once. The views must not be used after the exit.
+    """
+
+    def __init__(
+        self,
+        situation: Optional[VotingSituation] = None,
+        descriptor: Optional[Tuple] = None,
+    ) -> None:
+        """
+        Give either the situation to share or the descriptor of a shared one.
+
+        Args:
+            situation: voting situation to share
+            descriptor: descriptor of a block shared by another process
+        """
+        self._owner = situation is not None
+        self._source = situation
+        self.descriptor = descriptor
+        self.situation = None
+        self._memory = None
+
+    def open(self) -> "SharedVotingMatrix":
+        """
+        Create the block of shared memory, or attach to it.
+
+        Returns:
+            self, with the situation backed by shared memory
+        """
+        if self._owner:
+            matrix = self._source.voting_matrix
+            self._memory = shared_memory.SharedMemory(
+                create=True, size=max(matrix.nbytes, 1)
+            )
+            self.descriptor = (self._memory.name, matrix.shape, matrix.dtype.str)
+        else:
+            self._memory = shared_memory.SharedMemory(name=self.descriptor[0])
+
+        _, shape, dtype = self.descriptor
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._memory.buf)
+        if self._owner:
+            view[:] = self._source.voting_matrix
+        self.situation = VotingSituation.from_matrix(view)
+        return self
+
+    def close(self) -> None:
+        """
+        Release the mapping of the block, the owner also unlinks it.
+        """
+        self.situation = None
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+        self._memory = None
+
+    def __enter__(self) -> "SharedVotingMatrix":
+        return self.open()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def reference_tally(voting_scheme: VotingScheme, voting_matrix: np.array) -> np.array:
+    """
+    Compute the outcome of the votation with a loop over each cell of the
+    matrix, the original implementation of calculate_vote_given_matrix.
+    It is kept to verify the vectorized tallies.
+
+    Args:
+        voting_scheme: scheme used to assign votes
+        voting_matrix: voting situation
+
+    Returns:
+        voting_vector: number of votes for the each candidate.
+    """
+    candidate_am = voting_matrix.shape[0]
+    scheme_vector = compute_vot_scheme(voting_scheme, candidate_am)
+    voting_vector = np.zeros(candidate_am)
+    for i in range(candidate_am):  # for each candidate / row in matrix
+        for vote in voting_matrix[i]:
+            if vote != -1:  # No vote
+                voting_vector[vote] += scheme_vector[i]
+
+    return voting_vector
+
+
+def cross_check(
+    voters: Optional[int] = 20,
+    candidates: Optional[int] = 5,
+    trials: Optional[int] = 20,
+    allow_bullet_voting: Optional[bool] = True,
+    seed: Optional[int] = 0,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Compare the vectorized tallies with reference_tally on random situations
+
+    The outcome of the whole matrix (calculatevote), of a histogram of it,
+    of replacement ballots (calculate_votes_given_ballots, IncrementalTally)
+    and of all the schemes at once (MultiSchemeTally) must be the same
+    vector, bit by bit, as the loop over the cells.
+
+    Args:
+        voters (int): number of voters.
+        candidates (int): number of candidates.
+        trials (int): number of random situations.
+        allow_bullet_voting (bool): whether some voters do bullet voting.
+        seed (int): seed of the situations.
+
+    Returns:
+        For each scheme the number of outcomes checked and of outcomes that
+        differ from the reference ("mismatches"). An AssertionError is raised
+        if there is any mismatch.
+    """
+    rng = np.random.default_rng(seed)
+    report = {scheme.name: {"outcomes": 0, "mismatches": 0} for scheme in VotingScheme}
+    for _ in range(trials):
+        situation = VotingSituation.random(voters, candidates, rng)
+        matrix = situation.voting_matrix
+        if allow_bullet_voting:
+            # about a quarter of the voters only vote for their first choice
+            matrix[1:, rng.random(voters) < 0.25] = -1
+        histogram = VotingSituation.from_histogram(*situation.histogram())
+
+        # a random voter replaces its ballot with other random ballots
+        voter = int(rng.integers(voters))
+        ballots = rng.permuted(np.tile(matrix[:, voter], (4, 1)), axis=1)
+        if allow_bullet_voting:
+            ballots[0, 1:] = -1
+        multi = MultiSchemeTally(situation, list(VotingScheme)).outcomes(
+            voter, ballots
+        )
+
+        for s, scheme in enumerate(VotingScheme):
+            honest = reference_tally(scheme, matrix)
+            # (vectorized outcome, reference outcome)
+            pairs = [
+                (situation.calculatevote(scheme), honest),
+                (histogram.calculatevote(scheme), honest),
+            ]
+            replaced_outcomes = situation.calculate_votes_given_ballots(
+                scheme, matrix, voter, ballots
+            )
+            incremental = IncrementalTally(situation, scheme).outcomes(voter, ballots)
+            for b, ballot in enumerate(ballots):
+                replaced = matrix.copy()
+                replaced[:, voter] = ballot
+                reference = reference_tally(scheme, replaced)
+                pairs += [
+                    (replaced_outcomes[b], reference),
+                    (incremental[b], reference),
+                    (multi[s, b], reference),
+                ]
+
+            counts = report[scheme.name]
+            for outcome, reference in pairs:
+                counts["outcomes"] += 1
+                counts["mismatches"] += int(not np.array_equal(outcome, reference))
+
+    mismatched = {
+        name: counts for name, counts in report.items() if counts["mismatches"]
+    }
+    if mismatched:
+        raise AssertionError(f"Tallies differ from reference_tally: {mismatched}")
+    return report
 
 
 if __name__ == "__main__":
+    print("Comparing the vectorized tallies with the loop over the cells.")
+    for scheme_name, counts in cross_check().items():
+        print(scheme_name, counts)
+
     print("Tesing the voting situation and the happiness function.")
     print("Edit this file for other experiments.")
     VOTERS = 10
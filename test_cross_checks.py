@@ -0,0 +1,20 @@
+"""
+Checks of the vectorized tallies and of the solver against the reference
+implementations, run with pytest.
+"""
+import ManipulationSolver
+import VotingSituation
+
+
+def test_tallies_match_reference():
+    for allow_bullet_voting in (False, True):
+        VotingSituation.cross_check(
+            voters=12, trials=5, allow_bullet_voting=allow_bullet_voting
+        )
+
+
+def test_solver_matches_exhaustive_search():
+    for allow_bullet_voting in (False, True):
+        ManipulationSolver.cross_check(
+            voters=6, candidates=4, trials=3, allow_bullet_voting=allow_bullet_voting
+        )
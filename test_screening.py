@@ -0,0 +1,25 @@
+"""
+Regression checks of the screening of single voters, run with pytest.
+"""
+import numpy as np
+
+from TacticalVotingRisk import TacticalVotingRisk
+from VotingSituation import VotingSituation
+
+
+def count_risks(situation):
+    tva = TacticalVotingRisk(situation=situation, allow_bullet_voting=True)
+    return tva.compute_risk("counts")
+
+
+def test_screen_keeps_votings_of_bullet_ballots(monkeypatch):
+    rng = np.random.default_rng(0)
+    situation = VotingSituation.random(8, 4, rng)
+    # some voters only vote for their first choice
+    situation.voting_matrix[1:, [0, 3, 5]] = -1
+    screened = count_risks(situation)
+
+    monkeypatch.setattr(
+        TacticalVotingRisk, "_screen_tactical_votings", lambda *args: None
+    )
+    assert count_risks(situation) == screened